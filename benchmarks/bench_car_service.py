@@ -0,0 +1,169 @@
+"""Бенчмарки CarService
+   python -m benchmarks.bench_car_service --sizes 1000 10000 --output bench.json
+   python -m benchmarks.bench_car_service --sizes 1000 10000 --baseline bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime
+
+from benchmarks.generators import make_cars, make_models, make_sales
+from bibip_car_service import CarService
+from models import CarStatus
+
+# Размеры наборов данных (число авто) по умолчанию
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# Одиночные операции меряются на выборке из стольких вызовов
+SAMPLE = 200
+MODELS_COUNT = 50
+
+
+def measure(op: str, size: int, func: Callable[[], object], ops: int = 1, memory: bool = False) -> dict:
+    """ Время (и пиковая память через tracemalloc) одного прогона операции. """
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+    result = {'op': op, 'size': size, 'ops': ops, 'seconds': round(seconds, 6),
+              'us_per_op': round(seconds / max(ops, 1) * 1e6, 2)}
+    if memory:
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def bench_size(size: int, root_dir_path: str, memory: bool = False, wal_sync: bool = True,
+               record_format: str = 'text') -> list[dict]:
+    """ Прогон всех операций CarService на наборе из size авто. """
+    rnd = random.Random(size)
+    models = make_models(MODELS_COUNT)
+    cars = make_cars(size, MODELS_COUNT, seed=size)
+    sample = min(SAMPLE, size // 10)
+    sales = list(make_sales(cars[:size - sample], size // 2, seed=size))
+    lookup_vins = [car.vin for car in rnd.sample(cars, sample)]
+    results = []
+
+    def run(op: str, func: Callable[[], object], ops: int = 1) -> None:
+        results.append(measure(op, size, func, ops, memory))
+
+    service = CarService(root_dir_path, wal_sync=wal_sync, record_format=record_format)
+    run('add_models', lambda: service.add_models(models), len(models))
+    run('add_cars', lambda: service.add_cars(cars[:size - sample]), size - sample)
+    run('add_car', lambda: [service.add_car(car) for car in cars[size - sample:]], sample)
+    run('sell_cars', lambda: service.sell_cars(sales[:-sample]), len(sales) - sample)
+    run('sell_car', lambda: [service.sell_car(sale) for sale in sales[-sample:]], sample)
+    run('get_car_info', lambda: [service.get_car_info(vin) for vin in lookup_vins], sample)
+    service.car_info_cache.clear()
+    run('get_car_info_many', lambda: service.get_car_info_many(lookup_vins), sample)
+    run('get_cars', lambda: service.get_cars(CarStatus.available), 1)
+
+    def walk_pages() -> None:
+        cursor = None
+        for _ in range(sample):
+            _, cursor = service.get_cars_page(CarStatus.available, cursor, limit=50)
+    run('get_cars_page', walk_pages, sample)
+    run('find_cars_by_vin_prefix', lambda: [list(service.find_cars_by_vin_prefix(vin[:8])) for vin in lookup_vins],
+        sample)
+    # Окно в десятую часть разброса дат начала продаж
+    date_from = min(car.date_start for car in cars)
+    date_to = date_from + (max(car.date_start for car in cars) - date_from) / 10
+    run('find_cars_by_date_start', lambda: list(service.find_cars_by_date_start(date_from, date_to)), 1)
+    run('top_models_by_sales', lambda: [service.top_models_by_sales() for _ in range(sample)], sample)
+    run('top_models_by_revenue', lambda: service.top_models_by_sales(by='revenue'), 1)
+    # Отмена раньше смены VIN: продажа ищет авто по VIN из строки продажи
+    run('revert_sale', lambda: [service.revert_sale(sale.sales_number) for sale in sales[:sample]], sample)
+    run('update_vin', lambda: [service.update_vin(vin, vin[::-1]) for vin in lookup_vins], sample)
+    run('compact', service.compact, 1)
+    service.close()
+
+    restarted: list[CarService] = []
+    run('open', lambda: restarted.append(CarService(root_dir_path, wal_sync=wal_sync)), 1)
+    run('snapshot', restarted[0].snapshot, 1)
+    restarted[0].close()
+    return results
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[dict]:
+    """ Сравнение с сохранённым прогоном: к результатам добавляется отношение
+    ко времени в baseline; возвращаются операции, замедлившиеся больше threshold раз. """
+    base = {(result['op'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base_result = base.get((result['op'], result['size']))
+        if base_result is None or not base_result['seconds']:
+            continue
+        result['baseline_seconds'] = base_result['seconds']
+        result['ratio'] = round(result['seconds'] / base_result['seconds'], 3)
+        if result['ratio'] > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def _git_commit() -> str | None:
+    """ Текущий коммит, если бенчмарк запущен из git-репозитория. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарки операций CarService')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='размеры наборов (число авто)')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.2, help='допустимое замедление относительно baseline')
+    parser.add_argument('--memory', action='store_true',
+                        help='мерить пиковую память (tracemalloc замедляет операции)')
+    parser.add_argument('--no-fsync', action='store_true', help='без fsync журнала предзаписи')
+    parser.add_argument('--record-format', default='text', choices=('text', 'packed'))
+    parser.add_argument('--tmp-root', help='каталог для временных данных (по умолчанию системный)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        root_dir_path = tempfile.mkdtemp(prefix=f'bibip-bench-{size}-', dir=args.tmp_root)
+        try:
+            results.extend(bench_size(size, root_dir_path, args.memory, not args.no_fsync, args.record_format))
+        finally:
+            shutil.rmtree(root_dir_path, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    for result in results:
+        ratio = f"{result['ratio']:>7.2f}x" if 'ratio' in result else ''
+        peak = f"{result['peak_bytes'] / 2 ** 20:>9.1f} MiB" if 'peak_bytes' in result else ''
+        print(f"{result['size']:>9} {result['op']:<24} {result['ops']:>8} {result['seconds']:>11.4f} s "
+              f"{result['us_per_op']:>12.1f} us/op {peak} {ratio}")
+
+    if args.output:
+        report = {
+            'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+                     'python': sys.version.split()[0], 'platform': platform.platform(),
+                     'memory': args.memory, 'fsync': not args.no_fsync, 'record_format': args.record_format},
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for result in regressions:
+        print(f"Замедление: {result['op']} на {result['size']} авто в {result['ratio']} раз", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
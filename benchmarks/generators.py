@@ -0,0 +1,54 @@
+"""Синтетические данные для бенчмарков Bibip
+"""
+
+import random
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from models import Car, CarStatus, Model, Sale
+
+# Символы VIN: латиница без I, O, Q и цифры
+VIN_CHARS = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+
+BRANDS = ['Kia', 'Hyundai', 'Mazda', 'Nissan', 'Toyota', 'Skoda', 'Lada', 'Renault']
+
+
+def make_vins(n: int, seed: int = 0) -> list[str]:
+    """ n различных случайных VIN. """
+    rnd = random.Random(seed)
+    vins: set[str] = set()
+    while len(vins) < n:
+        vins.add(''.join(rnd.choices(VIN_CHARS, k=17)))
+    # Порядок множества не воспроизводим между запусками - перемешиваем с тем же seed
+    result = sorted(vins)
+    rnd.shuffle(result)
+    return result
+
+
+def make_models(n: int) -> list[Model]:
+    """ n моделей с id 1..n. """
+    return [Model(id=model_id, name=f'Model{model_id}', brand=BRANDS[model_id % len(BRANDS)])
+            for model_id in range(1, n + 1)]
+
+
+def make_cars(n: int, models_count: int, seed: int = 0) -> list[Car]:
+    """ n авто; популярность моделей неравномерна, как в реальных продажах. """
+    rnd = random.Random(seed)
+    weights = [1 / model_id for model_id in range(1, models_count + 1)]
+    model_ids = rnd.choices(range(1, models_count + 1), weights=weights, k=n)
+    start = datetime(2024, 1, 1)
+    return [Car(vin=vin, model=model_id, price=Decimal(rnd.randrange(500_000, 5_000_000)) / 100,
+                date_start=start + timedelta(minutes=rnd.randrange(0, 500_000)),
+                status=CarStatus.available)
+            for vin, model_id in zip(make_vins(n, seed), model_ids)]
+
+
+def make_sales(cars: list[Car], n: int, seed: int = 0) -> Iterator[Sale]:
+    """ Продажи n случайных различных авто из cars. """
+    rnd = random.Random(seed)
+    start = datetime(2024, 6, 1)
+    for i, car in enumerate(rnd.sample(cars, n)):
+        yield Sale(sales_number=f'{i:08d}#{car.vin}', car_vin=car.vin,
+                   sales_date=start + timedelta(minutes=rnd.randrange(0, 300_000)),
+                   cost=car.price)
@@ -0,0 +1,61 @@
+"""Агрегаты Bibip
+"""
+
+import os
+import heapq
+from collections.abc import Iterable
+from operator import itemgetter
+
+
+class ModelSalesCounter:
+    """ Счётчики продаж по моделям (model_sales.txt, строки «model_id,count»).
+    Модели хранятся в порядке первой продажи: при равном числе продаж
+    выше в отчёте та модель, которую продали раньше. Файл маленький
+    (одна строка на модель) и перезаписывается атомарно через os.replace.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.counts: dict[int, int] = {}
+        # Есть ли изменения, ещё не сброшенные на диск через sync()
+        self.unsynced = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for row in f:
+                    model_id, count = row.strip().split(',')
+                    self.counts[int(model_id)] = int(count)
+
+    def exists(self) -> bool:
+        """ Есть ли файл счётчиков на диске. """
+        return os.path.exists(self.path)
+
+    def update(self, deltas: Iterable[tuple[int, int]]) -> None:
+        """ Изменение счётчиков на delta (+1 продажа, -1 отмена) и сохранение. """
+        for model_id, delta in deltas:
+            self.counts[model_id] = self.counts.get(model_id, 0) + delta
+        self._save()
+
+    def replace_all(self, model_ids: Iterable[int]) -> None:
+        """ Пересчёт счётчиков по списку моделей проданных авто. """
+        self.counts = {}
+        self.update((model_id, 1) for model_id in model_ids)
+
+    def top(self, n: int) -> list[tuple[int, int]]:
+        """ n моделей с наибольшим числом продаж: O(m log n) по числу моделей m. """
+        return heapq.nlargest(n, ((model_id, count) for model_id, count in self.counts.items() if count > 0),
+                              key=itemgetter(1))
+
+    def sync(self) -> None:
+        """ Сброс файла счётчиков на диск. """
+        if self.exists():
+            with open(self.path, 'rb') as f:
+                os.fsync(f.fileno())
+        self.unsynced = False
+
+    def _save(self) -> None:
+        """ Атомарная перезапись файла счётчиков. """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for model_id, count in self.counts.items():
+                f.write(f'{model_id},{count}\n')
+        os.replace(tmp_path, self.path)
+        self.unsynced = True
@@ -0,0 +1,169 @@
+"""Асинхронный CarService Bibip
+"""
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Literal
+from bibip_car_service import CarService
+from models import Car, CarFullInfo, CarStatus, ModelSaleStats, Sale
+
+
+class AsyncCarService:
+    """ Асинхронная обёртка над CarService для event loop (aiohttp и т.п.).
+    Файловые операции выполняются в ограниченном пуле потоков, поэтому
+    event loop не блокируется. Одинаковые чтения, запущенные одновременно,
+    выполняются один раз, и все ожидающие получают свою копию результата.
+    Одновременные add_car и sell_car собираются в пачку и записываются
+    одним вызовом add_cars / sell_cars (одна запись журнала и одно слияние
+    индексов на пачку). Пока пачка пишется, следующие вызовы копятся.
+    """
+    def __init__(self, service: CarService, max_workers: int = 4) -> None:
+        self.service = service
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bibip')
+        # Выполняющиеся чтения: ключ запроса -> future
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        # Накопленные записи: вид записи -> [(аргумент, future вызывающего)]
+        self._batches: dict[str, list[tuple[Any, asyncio.Future]]] = {}
+        # Виды записей, пачка которых сейчас пишется
+        self._writing: set[str] = set()
+        # Ссылки на задачи записи пачек, чтобы их не собрал сборщик мусора
+        self._tasks: set[asyncio.Task] = set()
+        # Вид записи -> (пакетный метод, одиночный метод)
+        self._writers: dict[str, tuple[Callable, Callable]] = {
+            'add_car': (service.add_cars, service.add_car),
+            'sell_car': (service.sell_cars, service.sell_car),
+        }
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        """ Выполнение блокирующего вызова в пуле потоков. """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    async def _read(self, key: tuple, func: Callable, *args: Any) -> Any:
+        """ Чтение с объединением одинаковых одновременных запросов. """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(func, *args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._inflight.pop(key, None)
+                                     if self._inflight.get(key) is done else None)
+        # shield: отмена одного ожидающего не отменяет общее чтение
+        return self._copy(await asyncio.shield(future))
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        """ Копия результата, чтобы ожидающие не делили изменяемые объекты. """
+        if isinstance(value, list):
+            return [item.model_copy() for item in value]
+        if value is not None:
+            return value.model_copy()
+        return value
+
+    async def _write(self, func: Callable, *args: Any) -> Any:
+        """ Запись; чтения, начатые до неё, больше не объединяются с новыми. """
+        self._inflight.clear()
+        try:
+            return await self._run(func, *args)
+        finally:
+            self._inflight.clear()
+
+    async def _batched(self, kind: str, item: Any) -> Any:
+        """ Постановка записи в пачку и ожидание её результата. """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.setdefault(kind, [])
+        batch.append((item, future))
+        if len(batch) == 1 and kind not in self._writing:
+            # Пачка собирается до конца текущей итерации event loop
+            loop.call_soon(self._flush, kind)
+        return await future
+
+    def _flush(self, kind: str) -> None:
+        """ Запуск записи накопленной пачки. """
+        batch = self._batches.pop(kind, [])
+        if not batch:
+            return
+        self._writing.add(kind)
+        task = asyncio.ensure_future(self._write_batch(kind, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write_batch(self, kind: str, batch: list[tuple[Any, asyncio.Future]]) -> None:
+        """ Запись пачки одним пакетным вызовом. Если пачка не записалась
+        (например, в продаже неизвестный VIN), записи повторяются по одной,
+        чтобы ошибку получил только её автор. """
+        bulk, single = self._writers[kind]
+        try:
+            try:
+                results = await self._write(bulk, [item for item, _ in batch])
+            except Exception as exc:
+                if len(batch) == 1:
+                    self._set_exception(batch[0][1], exc)
+                    return
+                for item, future in batch:
+                    try:
+                        self._set_result(future, await self._write(single, item))
+                    except Exception as item_exc:
+                        self._set_exception(future, item_exc)
+                return
+            for (_, future), result in zip(batch, results):
+                self._set_result(future, result)
+        finally:
+            self._writing.discard(kind)
+            # Записи, накопленные за время записи пачки, уходят следующей пачкой
+            self._flush(kind)
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result: Any) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, exc: Exception) -> None:
+        if not future.done():
+            future.set_exception(exc)
+
+    async def add_car(self, car: Car) -> Car:
+        """ Сохранение авто (в пачке с одновременными вызовами). """
+        return await self._batched('add_car', car)
+
+    async def sell_car(self, sale: Sale) -> Car:
+        """ Сохранение продажи (в пачке с одновременными вызовами). """
+        return await self._batched('sell_car', sale)
+
+    async def get_cars(self, status: CarStatus) -> list[Car]:
+        """ Список авто со статусом. """
+        return await self._read(('get_cars', status), self.service.get_cars, status)
+
+    async def get_car_info(self, vin: str) -> CarFullInfo | None:
+        """ Детальная информация об авто. """
+        return await self._read(('get_car_info', vin), self.service.get_car_info, vin)
+
+    async def update_vin(self, vin: str, new_vin: str) -> Car:
+        """ Обновление ключевого поля car_vin. """
+        return await self._write(self.service.update_vin, vin, new_vin)
+
+    async def revert_sale(self, sales_number: str) -> Car:
+        """ Отмена продажи авто. """
+        return await self._write(self.service.revert_sale, sales_number)
+
+    async def compact(self) -> int:
+        """ Сжатие sales; чтения продолжаются, пока готовятся новые файлы. """
+        return await self._write(self.service.compact)
+
+    async def top_models_by_sales(self, n: int = 3, since: datetime | None = None, until: datetime | None = None,
+                                  by: Literal['count', 'revenue'] = 'count') -> list[ModelSaleStats]:
+        """ ТОП-n самых продаваемых моделей. """
+        return await self._read(('top_models_by_sales', n, since, until, by),
+                                partial(self.service.top_models_by_sales, n, since, until, by))
+
+    async def close(self) -> None:
+        """ Ожидание записи накопленных пачек и остановка пула потоков. """
+        while self._tasks or self._batches:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            else:
+                await asyncio.sleep(0)
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
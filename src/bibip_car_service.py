@@ -3,29 +3,49 @@
 """
 
 import os
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
 from decimal import Decimal
-from datetime import datetime
-from collections import Counter
+from datetime import datetime, timezone
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager, suppress
+from operator import itemgetter
+from typing import Literal
+from aggregates import ModelSalesCounter
+from cache import LRUCache
+from codec import car_full_info, decode_car, decode_model, decode_sale, encode_car, encode_model, encode_sale
+from indexes import FileIndex
+from locks import RWLock, reader, writer
+from metrics import Metrics, scoped_metrics, timed
 from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
+from record_formats import EPOCH, MICROSECOND, get_format
+from snapshot import Snapshot
+from storage import FLG_DEL, RecordFile
+from wal import WriteAheadLog
 
+# Сколько строк iter_cars читает за одно взятие блокировки
+ITER_CHUNK = 256
+# Вторичные индексы, появившиеся после первой версии каталога;
+# построенные перечислены в indexes.txt
+SECONDARY_INDEXES = ('sales_number_index', 'cars_status_index', 'cars_date_index', 'free_rows_index')
 
-class ModelIndex:
-    """ Инициализация класса индексов models """
-    def __init__(self, model_id: int, pif_models: int):
-        self.model_id = model_id
-        self.pif_models = pif_models
 
-class CarIndex:
-    """ Инициализация класса индексов cars """
-    def __init__(self, car_id: str, pif_cars: int):
-        self.car_id = car_id
-        self.pif_cars = pif_cars
+def _date_key(value: datetime | str) -> int:
+    """ Ключ индекса по дате: микросекунды от 1970-01-01 (строка - поле строки cars).
+    Дата с часовым поясом переводится в UTC; дата без пояса считается датой в UTC. """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (_utc(value) - EPOCH) // MICROSECOND
+
+
+def _utc(value: datetime) -> datetime:
+    """ Дата без часового пояса: дата с поясом переводится в UTC, дата без пояса не меняется. """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
-class SaleIndex:
-    """ Инициализация класса индексов sales """
-    def __init__(self, car_vin: str, pif_sales: int):
-        self.car_vin = car_vin
-        self.pif_sales = pif_sales
 
 class CarService:
     """ Класс CarService. 
@@ -37,410 +57,935 @@ class CarService:
     3. Список доступных к продаже авто.
     4. Получение детальной информации об авто.
     5. Обновление ключевого поля.
-    6. Удаление строки в продажах (отмена).
-    7. Список трёх самых продаваемых моделей.
+    6. Отмена продажи (пометка строки удалённой), повторное использование
+       освободившихся строк, сжатие файла продаж без остановки чтений.
+    7. Список самых продаваемых моделей (по числу или сумме продаж, за период).
+    Изменения записываются в журнал предзаписи, незавершённые операции
+    доводятся до конца при следующем открытии каталога.
     """
     def _format_path(self, filename: str) -> str:
         """ Объединяем root_directory_path и имя файла для получения полного пути """
         return os.path.join(self.root_dir_path, filename)
 
-    def _r_file(self, filename: str) -> list[list[str]]:
-        """ Приватный метод. Чтение файла."""
-        if not os.path.exists(self._format_path(filename)):
-            return []
-        else:
-            with open(self._format_path(filename), 'r', encoding='utf-8') as f:
-                rows = f.readlines()
-                split_rows= [row.strip().split(',') for row in rows]
-                return split_rows
-
-    def __init__(self, root_dir_path: str) -> None:
+    def __init__(self, root_dir_path: str, use_mmap: bool = False, cache_size: int = 1024,
+                 wal_sync: bool = True, checkpoint_every: int = 256,
+                 record_format: Literal['text', 'packed'] = 'text', validate_reads: bool = False) -> None:
         self.root_dir_path = root_dir_path
-        self.model_index: list[ModelIndex] = []
-        self.car_index: list[CarIndex] = []
-        self.sale_index:list[SaleIndex] = []
-
-        split_rows_mi = self._r_file("models_index.txt")
-        self.model_index = [ModelIndex(int(r[0]), int(r[1])) for r in split_rows_mi]
-
-        split_rows_ci = self._r_file('cars_index.txt')
-        self.car_index = [CarIndex(str(r[0]), int(r[1])) for r in split_rows_ci]
-
-        split_rows_si = self._r_file('sales_index.txt')
-        self.sale_index = [SaleIndex(str(r[0]), int(r[1])) for r in split_rows_si]
-
-    def _rw_file(self, filepath: str, data: list, ljust_par: int) -> None:
-        """Приватный метод. Перезапись файла."""
-        with open(filepath, 'w', encoding='utf-8') as f:
-            for item in data:
-                result = ','.join([x for x in item]).ljust(ljust_par) + '\n'
-                f.write(result)
-
-    def _get_model_info(self, model_id: str) -> Model:
-        """ Получение информации по id модели. """
-        # читаем индекс и определяем номер строки в models
-        with open(self._format_path('models_index.txt'), 'r', encoding='utf-8') as fmi:
-            for row_mi in fmi:
-                mod_id, row_mi_rnum = row_mi.strip().split(',')
-                if mod_id == model_id:
-                    target_row = int(row_mi_rnum) # искомая строка в models
-                    break
-            else:
-                raise ValueError('ID модели снет найден в продажах')
+        self.use_mmap = use_mmap
+        # Строки данных записал сам сервис, поэтому по умолчанию они разбираются
+        # без проверок pydantic; validate_reads = True включает проверки
+        self._trusted = not validate_reads
+        # Формат новых файлов данных; существующие файлы читаются в своём формате
+        self.record_format = record_format
+        # Журнал предзаписи; wal_sync = False отключает fsync (например, для тестов)
+        self._wal = WriteAheadLog(self._format_path('wal.log'), sync=wal_sync)
+        # Через сколько завершённых операций делается контрольная точка
+        self.checkpoint_every = checkpoint_every
+        # Операция текущей записи в журнале
+        self._tx: str | None = None
+        # Данные для отката текущей операции: число строк в файлах до неё
+        # и прежнее содержимое перезаписываемых строк
+        self._undo: tuple[dict[str, int], list[tuple[str, int, bytes]]] = ({}, [])
+        # Изменила ли данные текущая операция записи (только тогда растёт поколение)
+        self._changed = False
+        # Чтения выполняются параллельно, изменения - монопольно, в том числе
+        # между процессами, работающими с одним каталогом
+        self._lock = RWLock(self._format_path('service.lock'))
+        # Кэши разобранных строк; cache_size = 0 отключает кэширование
+        self.model_cache = LRUCache(cache_size)  # id модели -> Model
+        self.car_cache = LRUCache(cache_size)  # номер строки в cars -> Car
+        self.sale_cache = LRUCache(cache_size)  # номер строки в sales -> Sale
+        self.car_info_cache = LRUCache(cache_size)  # VIN -> CarFullInfo
+        # Метрики выключены, пока не вызван enable_metrics() или instrumented()
+        self.metrics: Metrics | None = None
+        # Колоночный снимок для аналитики строится по первому вызову snapshot()
+        self._snapshot_lock = threading.Lock()
+        # Сжатия одного экземпляра не пересекаются: их временные файлы общие
+        self._compact_lock = threading.Lock()
+        with self._lock.write():
+            # Восстановление: записи журнала повторяются в файлах данных (запись
+            # строки идемпотентна). Изменения индексов завершённой операции сброшены
+            # на диск до отметки о завершении (см. _writing), поэтому индексы
+            # перестраиваются, только если операция оборвалась без этой отметки
+            records = self._wal.records()
+            self._replay_wal(records)
+            self._load()
+            if any(not record['committed'] for record in records):
+                self._rebuild_indexes()
+                self._flush()
+                self._generation = self._lock.bump_generation()
+
+    def _load(self) -> None:
+        """ Открытие файлов данных и индексов при создании сервиса. Индексы
+        загружаются при первом обращении; вторичные индексы, которых ещё нет
+        в каталоге (по списку в indexes.txt), строятся один раз по файлам данных. """
+        self._reopen()
+        # Индексы: ключ -> номер строки в файле данных
+        self.model_index = FileIndex(self._format_path('models_index.txt'), key_type=int)
+        self.car_index = FileIndex(self._format_path('cars_index.txt'))
+        self.sale_index = FileIndex(self._format_path('sales_index.txt'))
+        # Индекс продаж по номеру продажи
+        self.sales_number_index = FileIndex(self._format_path('sales_number_index.txt'))
+        # Вторичный индекс: статус авто -> номера строк в cars
+        self.car_status_index = FileIndex(self._format_path('cars_status_index.txt'))
+        # Вторичный индекс: дата начала продаж -> номера строк в cars
+        self.car_date_index = FileIndex(self._format_path('cars_date_index.txt'), key_type=int)
+        # Свободные строки файлов данных: имя файла -> номера строк отменённых
+        # продаж, которые занимают следующие записи вместо дозаписи в конец
+        self.free_index = FileIndex(self._format_path('free_rows_index.txt'))
+        # Счётчики продаж по моделям для отчёта о самых продаваемых моделях
+        self.model_sales = ModelSalesCounter(self._format_path('model_sales.txt'))
+        built = self._read_built_indexes()
+        missing = [name for name in SECONDARY_INDEXES if name not in built]
+        if missing:
+            # Каталог создан до появления этих индексов - строим их по файлам данных
+            for name in missing:
+                self._build_index(name)
+            self._write_built_indexes()
+        if not self.model_sales.exists():
+            # Каталог создан до появления счётчиков - считаем продажи по sales и cars
+            self._build_index('model_sales')
+        self._attach_metrics()
+
+    def _read_built_indexes(self) -> set[str]:
+        """ Вторичные индексы, уже построенные в каталоге (indexes.txt). """
+        path = self._format_path('indexes.txt')
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            return {row.strip() for row in f}
+
+    def _write_built_indexes(self) -> None:
+        """ Атомарная запись списка построенных вторичных индексов. """
+        path = self._format_path('indexes.txt')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(''.join(f'{name}\n' for name in SECONDARY_INDEXES))
+        os.replace(path + '.tmp', path)
+
+    def _build_index(self, name: str) -> None:
+        """ Построение вторичного индекса (или счётчиков, name = 'model_sales') по файлам данных. """
+        if name == 'sales_number_index':
+            self.sales_number_index.replace_all([(row_sale[0], row_num)
+                                                 for row_num, row_sale in self._iter_active_sales()])
+        elif name == 'cars_status_index':
+            self.car_status_index.replace_all([(row_car[4], row_num)
+                                               for row_num, row_car in enumerate(self.cars_file.iter_rows())])
+        elif name == 'cars_date_index':
+            self.car_date_index.replace_all([(_date_key(row_car[3]), row_num)
+                                             for row_num, row_car in enumerate(self.cars_file.iter_rows())])
+        elif name == 'free_rows_index':
+            active_rows = {row_num for row_num, _ in self._iter_active_sales()}
+            self.free_index.replace_all([('sales', row_num) for row_num in range(len(self.sales_file))
+                                         if row_num not in active_rows])
+        elif name == 'model_sales':
+            sold_vins = [row_sale[1] for _, row_sale in self._iter_active_sales()]
+            # Продажи, записанные до того, как update_vin стал переносить их на новый VIN,
+            # не относятся ни к одному авто и не учитываются
+            car_rows = [row_num for row_num in map(self._find_car_row, sold_vins) if row_num is not None]
+            # Пустой каталог: файла cars может ещё не быть
+            model_ids = [int(row_car[1]) for row_car in self.cars_file.read_many(car_rows)] if car_rows else []
+            self.model_sales.replace_all(model_ids)
+
+    def _reopen(self) -> None:
+        """ Сброс кэшей и снимка и открытие файлов данных заново: другой процесс
+        мог подменить файл (compact, migrate). """
+        # Поколение, которому соответствуют загруженные индексы
+        self._generation = self._lock.generation()
+        for cache in (self.model_cache, self.car_cache, self.sale_cache, self.car_info_cache):
+            cache.clear()
+        self._snapshot: Snapshot | None = None
+        # Строки, изменённые на месте после построения снимка
+        self._snapshot_dirty: dict[str, set[int]] = {'cars': set(), 'sales': set()}
+        # Файлы данных; use_mmap - отображать файлы в память
+        if hasattr(self, 'cars_file'):
+            self._close_files()
+        self.models_file = self._open_data_file('models', self.use_mmap)
+        self.cars_file = self._open_data_file('cars', self.use_mmap)
+        self.sales_file = self._open_data_file('sales', self.use_mmap)
+
+    def _refresh(self) -> None:
+        """ Подхват изменений другого процесса (сменилось поколение). Индексы не
+        перечитываются целиком: каждый дочитывает новые строки своего журнала
+        или, если снимок подменён, загрузится заново при первом обращении. """
+        self._reopen()
+        for index in self._indexes():
+            index.refresh()
+        self.model_sales = ModelSalesCounter(self._format_path('model_sales.txt'))
+        self._attach_metrics()
+
+    def _indexes(self) -> tuple[FileIndex, ...]:
+        """ Все индексы сервиса. """
+        return (self.model_index, self.car_index, self.sale_index, self.sales_number_index,
+                self.car_status_index, self.car_date_index, self.free_index)
+
+    def _attach_metrics(self) -> None:
+        """ Передача текущих метрик файлам данных, индексам и журналу. """
+        for counted in (self.models_file, self.cars_file, self.sales_file, *self._indexes(), self._wal):
+            counted.metrics = self.metrics
+
+    def enable_metrics(self) -> Metrics:
+        """ Включение метрик: задержки по методам и счётчики ввода-вывода. """
+        if self.metrics is None:
+            self.metrics = Metrics()
+            self._attach_metrics()
+        return self.metrics
+
+    def disable_metrics(self) -> None:
+        """ Выключение метрик. """
+        self.metrics = None
+        self._attach_metrics()
+
+    @contextmanager
+    def instrumented(self) -> Iterator[Metrics]:
+        """ Метрики только для вызовов текущего потока внутри блока with;
+        вызовы из других потоков в них не попадают. """
+        with scoped_metrics() as metrics:
+            yield metrics
+
+    def _open_data_file(self, name: str, use_mmap: bool = False) -> RecordFile:
+        """ Файл данных models, cars или sales. """
+        return RecordFile(self._format_path(f'{name}.txt'), use_mmap, get_format(self.record_format, name))
+
+    def _close_files(self) -> None:
+        """ Освобождение отображений файлов данных. """
+        self.models_file.close()
+        self.cars_file.close()
+        self.sales_file.close()
+
+    def close(self) -> None:
+        """ Контрольная точка и освобождение файлов данных, журнала и файла блокировки. """
+        with self._writing():
+            self._checkpoint()
+        self._close_files()
+        self._wal.close()
+        self._lock.close()
+
+    def _replay_wal(self, records: list[dict]) -> None:
+        """ Повтор записей журнала предзаписи в файлах данных. """
+        if not records:
+            return
+        files = {name: self._open_data_file(name) for name in ('models', 'cars', 'sales')}
+        for record in records:
+            for name, data_file in files.items():
+                rows = [(row_num, row) for file_name, row_num, row in record['writes'] if file_name == name]
+                if rows:
+                    data_file.write_many(rows)
+
+    def _rebuild_indexes(self) -> None:
+        """ Перестроение всех индексов и счётчиков по файлам данных. """
+        self._changed = True
+        for cache in (self.model_cache, self.car_cache, self.sale_cache, self.car_info_cache):
+            cache.clear()
+        self.model_index.replace_all([(int(row_model[0]), row_num)
+                                      for row_num, row_model in enumerate(self.models_file.iter_rows())])
+        rows_cars = list(enumerate(self.cars_file.iter_rows()))
+        self.car_index.replace_all([(row_car[0], row_num) for row_num, row_car in rows_cars])
+        self.car_status_index.replace_all([(row_car[4], row_num) for row_num, row_car in rows_cars])
+        self.car_date_index.replace_all([(_date_key(row_car[3]), row_num) for row_num, row_car in rows_cars])
+        rows_sales = list(self._iter_active_sales())
+        self.sale_index.replace_all([(row_sale[1], row_num) for row_num, row_sale in rows_sales])
+        self.sales_number_index.replace_all([(row_sale[0], row_num) for row_num, row_sale in rows_sales])
+        active_rows = {row_num for row_num, _ in rows_sales}
+        self.free_index.replace_all([('sales', row_num) for row_num in range(len(self.sales_file))
+                                     if row_num not in active_rows])
+        # Продажи, оставшиеся на старом VIN (update_vin прежних версий), в счётчики не попадают
+        vin_models = {row_car[0]: int(row_car[1]) for _, row_car in rows_cars}
+        self.model_sales.replace_all(vin_models[row_sale[1]] for _, row_sale in rows_sales
+                                     if row_sale[1] in vin_models)
+
+    def _checkpoint(self) -> None:
+        """ Контрольная точка: файлы данных, индексов и счётчиков сбрасываются
+        на диск одной пачкой, после чего журнал очищается. Вызывается под
+        блокировкой на запись, поэтому операция без отметки о завершении
+        прервана аварийным завершением процесса - её записи повторяются,
+        индексы перестраиваются. """
+        records = self._wal.records()
+        if any(not record['committed'] for record in records):
+            self._replay_wal(records)
+            self._rebuild_indexes()
+        self._flush()
+
+    def _flush(self) -> None:
+        """ Сброс файлов данных, индексов и счётчиков на диск и очистка журнала. """
+        if self._wal.sync:
+            for data_file in (self.models_file, self.cars_file, self.sales_file):
+                data_file.sync()
+            for index in self._indexes():
+                index.sync()
+            self.model_sales.sync()
+        self._wal.truncate()
+
+    def _begin(self, op: str, writes: list[tuple[str, int, str]]) -> list[bytes]:
+        """ Запись операции в журнал предзаписи до изменения файлов данных.
+        Строки кодируются до записи в журнал: строка, которую нельзя записать
+        (слишком длинная, неверная сумма), отклоняется раньше, чем попадёт в
+        журнал. Возвращает закодированные строки в порядке writes. """
+        files = self._data_files()
+        data = [files[name].format.encode(row) for name, _, row in writes]
+        # Для отката: длина файлов и прежнее содержимое перезаписываемых строк
+        sizes = {name: len(files[name]) for name, _, _ in writes}
+        before = []
+        for name, data_file in files.items():
+            row_nums = [row_num for file_name, row_num, _ in writes if file_name == name and row_num < sizes[name]]
+            if row_nums:
+                before.extend(zip([name] * len(row_nums), row_nums, data_file.read_raw(row_nums)))
+        self._tx = self._wal.begin(op, writes)
+        self._undo = (sizes, before)
+        self._changed = True
+        if self._snapshot is not None:
+            for name, row_num, _ in writes:
+                if name in self._snapshot_dirty:
+                    self._snapshot_dirty[name].add(row_num)
+        return data
+
+    def _data_files(self) -> dict[str, RecordFile]:
+        """ Файлы данных по именам, которыми они записаны в журнале. """
+        return {'models': self.models_file, 'cars': self.cars_file, 'sales': self.sales_file}
+
+    def _rollback(self) -> None:
+        """ Откат операции, прерванной исключением: прежние строки возвращаются
+        на место, дописанные отбрасываются, индексы перестраиваются по файлам
+        данных. Затем делается контрольная точка: откаченные файлы сбрасываются
+        на диск и журнал очищается, поэтому операция, о сбое которой узнал
+        вызывающий, не повторяется при восстановлении. """
+        sizes, before = self._undo
+        for name, data_file in self._data_files().items():
+            rows = [(row_num, row) for file_name, row_num, row in before if file_name == name]
+            if rows:
+                data_file.write_many(rows)
+            if name in sizes:
+                data_file.truncate(sizes[name])
+        self._rebuild_indexes()
+        self._flush()
+        self._snapshot = None
+
+    def _sync(self) -> None:
+        """ Подхват изменений, если данные изменил другой процесс (сменилось поколение). """
+        if self._lock.generation() != self._generation:
+            self._refresh()
+
+    @contextmanager
+    def _reading(self) -> Iterator[None]:
+        """ Блокировка на чтение актуального поколения данных. """
+        while True:
+            with self._lock.read():
+                if self._lock.generation() == self._generation:
+                    yield
+                    return
+            # Индексы устарели: перезагружаем монопольно и пробуем снова
+            with self._lock.write():
+                self._sync()
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """ Блокировка на запись; поколение увеличивается, только если операция
+        изменила данные: неудавшаяся проверка или close() не заставляют другие
+        процессы подхватывать изменения. """
+        with self._lock.write():
+            self._sync()
+            self._tx = None
+            self._changed = False
+            try:
+                try:
+                    yield
+                except BaseException:
+                    if self._tx is not None:
+                        self._rollback()
+                    raise
+                if self._tx is not None:
+                    if self._wal.sync:
+                        # Изменения индексов и счётчиков попадают на диск раньше отметки
+                        # о завершении: при восстановлении индексы завершённых операций
+                        # не перестраиваются, повторяются только строки данных
+                        for index in (*self._indexes(), self.model_sales):
+                            if index.unsynced:
+                                index.sync()
+                    self._wal.commit(self._tx)
+                    if self._wal.committed >= self.checkpoint_every:
+                        self._checkpoint()
+            finally:
+                self._tx = None
+                self._undo = ({}, [])
+                if self._changed:
+                    self._generation = self._lock.bump_generation()
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        """ Попадания и промахи кэшей. """
+        return {'models': self.model_cache.stats(), 'cars': self.car_cache.stats(),
+                'sales': self.sale_cache.stats(), 'car_info': self.car_info_cache.stats()}
+
+    def _find_model_row(self, model_id: int) -> int | None:
+        """ Номер строки в models по id модели. """
+        return self.model_index.find(model_id)
+
+    def _find_car_row(self, vin: str) -> int | None:
+        """ Номер строки в cars по VIN. """
+        return self.car_index.find(vin)
+
+    def _find_sale_row(self, vin: str) -> int | None:
+        """ Номер строки в sales по VIN. """
+        return self.sale_index.find(vin)
+
+    def _iter_active_sales(self) -> Iterator[tuple[int, list[str]]]:
+        """ Обход неотменённых продаж: (номер строки, поля). """
+        for row_num, row_sale in enumerate(self.sales_file.iter_rows()):
+            if row_sale[4:5] != [FLG_DEL]:
+                yield row_num, row_sale
+
+    def _read_model(self, model_id: int) -> Model | None:
+        """ Модель по id через кэш (None - модели нет). """
+        model_id = int(model_id)
+        model = self.model_cache.get(model_id)
+        if model is None:
+            # бинарным поиском по отображённому снимку индекса определяем номер строки в models
+            target_row_mi = self._find_model_row(model_id)
+            if target_row_mi is None:
+                return None
+            model = decode_model(self.models_file.read_fields(target_row_mi), self._trusted)
+            self.model_cache.put(model_id, model)
+        return model
+
+    def _read_car(self, row_num: int) -> Car:
+        """ Авто по номеру строки в cars через кэш. """
+        car = self.car_cache.get(row_num)
+        if car is None:
+            car = decode_car(self.cars_file.read_fields(row_num), self._trusted)
+            self.car_cache.put(row_num, car)
+        return car
 
-        with open(self._format_path('models.txt'), 'r', encoding='utf-8') as fm:
-            fm.seek(target_row * 502)
-            row_model = fm.readline().strip().split(',')
+    def _read_sale(self, row_num: int) -> Sale:
+        """ Продажа по номеру строки в sales через кэш. """
+        sale = self.sale_cache.get(row_num)
+        if sale is None:
+            sale = decode_sale(self.sales_file.read_fields(row_num), self._trusted)
+            self.sale_cache.put(row_num, sale)
+        return sale
 
-        return Model(id=row_model[0], name=row_model[1], brand=row_model[2])
+    def _invalidate_car(self, row_num: int, *vins: str) -> None:
+        """ Сброс кэшей после изменения строки авто. """
+        self.car_cache.invalidate(row_num)
+        for vin in vins:
+            self.car_info_cache.invalidate(vin)
 
     # Задание 1.1 Сохранение моделей авто, создание индексов.
+    @timed
     def add_model(self, model: Model) -> Model:
         """ Сохранение моделей авто, создание индексов. """
-        # открываем файл  models на добавление строк и формируем строки из атрибутов класса Model
-        with open(self._format_path('models.txt'), 'a', encoding="utf-8") as fm:
-            str_model = f'{model.id},{model.name},{model.brand}'.ljust(500) + '\n'
-            fm.write(str_model)
-
-        # Создаем экемпляр сласса ModelIndex
-        new_mi = ModelIndex(model.id, len(self.model_index))
-        self.model_index.append(new_mi)
-        self.model_index.sort(key=lambda x: x.model_id)
-
-        # Создание файла с индексами, отсортированными по ключевому полю
-        self._rw_file(self._format_path('models_index.txt'),
-                        data=[[str(current_mi.model_id), str(current_mi.pif_models)]
-                              for current_mi in self.model_index],
-                        ljust_par=50)
-
+        self.add_models([model])
         return model
 
+    @timed
+    @writer
+    def add_models(self, models: Iterable[Model]) -> list[Model]:
+        """ Пакетное сохранение моделей авто: одна запись в файл, одно слияние индекса. """
+        models = list(models)
+        # формируем строки из атрибутов класса Model и пишем их одним блоком
+        rows_models = [encode_model(model) for model in models]
+        first_row = len(self.models_file)
+        data = self._begin('add_models', [('models', first_row + i, row) for i, row in enumerate(rows_models)])
+        self.models_file.append(data)
+
+        # Добавляем записи в индекс по ключевому полю
+        self.model_index.add_many([(model.id, first_row + i) for i, model in enumerate(models)])
+        for model in models:
+            self.model_cache.invalidate(model.id)
+
+        return models
+
     # Задание 1.2 Сохранение авто, создание индексов.
+    @timed
     def add_car(self, car: Car) -> Car:
         """ Сохранение авто, создание индексов. """
-        with open(self._format_path("cars.txt"), "a", encoding="utf-8") as fc:
-            str_cars = f'{car.vin},{car.model},{car.price},{car.date_start},{car.status}'.ljust(500) + '\n'
-            fc.write(str_cars)
-
-        # Создаем экемпляр сласса CarIndex
-        new_ci = CarIndex(car.vin, len(self.car_index))
-        self.car_index.append(new_ci)
-        self.car_index.sort(key=lambda x: x.car_id)
+        self.add_cars([car])
+        return car
 
-        # Создание файла с индексами cars_index по ключевому полю car_id - VIN
-        self._rw_file(self._format_path('cars_index.txt'),
-                         data=[[str(current_ci.car_id),
-                                str(current_ci.pif_cars)] for current_ci in self.car_index],
-                         ljust_par=50)
+    @timed
+    @writer
+    def add_cars(self, cars: Iterable[Car]) -> list[Car]:
+        """ Пакетное сохранение авто: одна запись в файл, одно слияние индекса. """
+        cars = list(cars)
+        rows_cars = [encode_car(car) for car in cars]
+        first_row = len(self.cars_file)
+        data = self._begin('add_cars', [('cars', first_row + i, row) for i, row in enumerate(rows_cars)])
+        self.cars_file.append(data)
+
+        # Добавляем записи в индекс cars_index по ключевому полю car_id - VIN
+        self.car_index.add_many([(car.vin, first_row + i) for i, car in enumerate(cars)])
+        self.car_status_index.add_many([(car.status, first_row + i) for i, car in enumerate(cars)])
+        self.car_date_index.add_many([(_date_key(car.date_start), first_row + i) for i, car in enumerate(cars)])
+        for car in cars:
+            self.car_info_cache.invalidate(car.vin)
 
-        return car
+        return cars
 
     # Задание 2. Сохранение продаж.
+    @timed
     def sell_car(self, sale: Sale) -> Car:
         """ Сохранение продажи, изменения статуса авто в cars. """
-        with open(self._format_path('sales.txt'), 'a', encoding='utf-8') as fs:
-            str_sales = f'{sale.sales_number},{sale.car_vin},{sale.sales_date},{sale.cost}'.ljust(500) + '\n'
-            fs.write(str_sales)
-
-        # Создаем экемпляр сласса SaleIndex
-        new_si = SaleIndex(car_vin=sale.car_vin, pif_sales=len(self.sale_index))
-        self.sale_index.append(new_si)
-        self.sale_index.sort(key=lambda x: x.car_vin)
-
-        # Создание файла с индексами sales_index по ключевому полю VIN
-        self._rw_file(self._format_path('sales_index.txt'),
-                         data=[[str(current_si.car_vin),
-                                str(current_si.pif_sales)] for current_si in self.sale_index],
-                         ljust_par=50)
-
-        # Номер строки в индексе по VIN
-        rows_ci = self._r_file(self._format_path('cars_index.txt'))
-        target_row_ci = -1
-        for row_ci in rows_ci:
-            car_id, row_ci_rnum = row_ci[0], row_ci[1]
-            if car_id == sale.car_vin:
-                target_row_ci = int(row_ci_rnum)
-                break
-        if target_row_ci == -1:
-            raise ValueError(f'Авто с VIN-кодом "{sale.car_vin}" не найден')
-
-        # Обновляем статус в cars, что авто продан
-        with open(self._format_path('cars.txt'), 'r+', encoding='utf-8') as fc:
-            fc.seek(target_row_ci * 502)
-            rows_cars = fc.readline()
-            row_car = rows_cars.strip().split(',')
-            car = Car(
-                vin=str(row_car[0]),
-                model=int(row_car[1]),
-                price = Decimal(row_car[2]),
-                date_start = datetime.strptime(row_car[3], "%Y-%m-%d %H:%M:%S"),
-                status=CarStatus(row_car[4])
-                )
+        return self.sell_cars([sale])[0]
+
+    @timed
+    @writer
+    def sell_cars(self, sales: Iterable[Sale]) -> list[Car]:
+        """ Пакетное сохранение продаж и изменение статусов авто за один проход по cars. """
+        sales = list(sales)
+        # Номера строк в cars по VIN; проверяем все авто до записи продаж
+        target_rows_ci = []
+        for sale in sales:
+            target_row_ci = self._find_car_row(sale.car_vin)
+            if target_row_ci is None:
+                raise ValueError(f'Авто с VIN-кодом "{sale.car_vin}" не найден')
+            target_rows_ci.append(target_row_ci)
+
+        # Обновляем статус в cars, что авто продан. Строки идут по возрастанию смещения
+        sold_cars: dict[int, Car] = {}
+        old_statuses = []
+        rows_car_upd = []
+        target_rows = sorted(set(target_rows_ci))
+        for target_row_ci, row_car in zip(target_rows, self.cars_file.read_many(target_rows)):
+            car = decode_car(row_car, self._trusted)
+            old_statuses.append((car.status, target_row_ci))
             car.status = CarStatus.sold
-            fc.seek(target_row_ci * 502)
-            row_car_upd = f'{car.vin},{car.model},{car.price},{car.date_start},{car.status}'.ljust(500) + '\n'
-            fc.write(row_car_upd)
-
-        return car
+            row_car_upd = encode_car(car)
+            rows_car_upd.append((target_row_ci, row_car_upd))
+            sold_cars[target_row_ci] = car
+
+        # Продажи и новые строки авто записываются в журнал одной записью
+        rows_sales = [encode_sale(sale) for sale in sales]
+        sale_rows = self._allocate_rows('sales', self.sales_file, len(rows_sales))
+        data = self._begin('sell_cars', [('sales', row_num, row) for row_num, row in zip(sale_rows, rows_sales)]
+                           + [('cars', row_num, row) for row_num, row in rows_car_upd])
+        data_sales, data_cars = data[:len(rows_sales)], data[len(rows_sales):]
+        self._store_rows('sales', self.sales_file, sale_rows, data_sales)
+        for row_num in sale_rows:
+            self.sale_cache.invalidate(row_num)
+
+        # Добавляем записи в индекс sales_index по ключевому полю VIN
+        self.sale_index.add_many([(sale.car_vin, row_num) for row_num, sale in zip(sale_rows, sales)])
+        self.sales_number_index.add_many([(sale.sales_number, row_num) for row_num, sale in zip(sale_rows, sales)])
+
+        self.cars_file.write_many(zip([row_num for row_num, _ in rows_car_upd], data_cars))
+        for target_row_ci, car in sold_cars.items():
+            self._invalidate_car(target_row_ci, car.vin)
+
+        # Переносим строки в индексе по статусу
+        self.car_status_index.apply(old_statuses,
+                                    [(CarStatus.sold, row_num) for _, row_num in old_statuses])
+        # Увеличиваем счётчики продаж моделей
+        self.model_sales.update((sold_cars[target_row_ci].model, 1) for target_row_ci in target_rows_ci)
+
+        return [sold_cars[target_row_ci] for target_row_ci in target_rows_ci]
 
     # Задание 3. Доступные к продаже
+    @timed
     def get_cars(self, status: CarStatus) -> list[Car]:
         """ Определение списка доступных к продаже авто """
-        cars = []
-        rows_cars = self._r_file(self._format_path('cars.txt'))
-        for row_car in rows_cars:
-            if row_car[4] == status:
-                car = Car(
-                          vin=row_car[0],
-                          model=int(row_car[1]),
-                          price=Decimal(row_car[2]),
-                          date_start=datetime.strptime(row_car[3], '%Y-%m-%d %H:%M:%S'),
-                          status=CarStatus(row_car[4])
-                          )
-                cars.append(car)
+        cars = list(self.iter_cars(status))
         # Сортировка по VIN
         #cars = sorted(cars, key=lambda car: car.vin)
         return cars
 
+    def iter_cars(self, status: CarStatus, offset: int | None = None, limit: int | None = None,
+                  after: int | None = None) -> Iterator[Car]:
+        """ Ленивый обход авто со статусом в порядке строк cars.
+        after - курсор (номер строки последнего полученного авто).
+        Строки читаются порциями по ITER_CHUNK, блокировка на чтение берётся
+        на каждую порцию и не удерживается, пока вызывающий обрабатывает авто. """
+        offset = offset or 0
+        while limit is None or limit > 0:
+            chunk = ITER_CHUNK if limit is None else min(ITER_CHUNK, limit)
+            with self._reading():
+                # Читаем только строки с нужным статусом, номера берём из индекса по статусу
+                row_nums = list(self.car_status_index.iter_key(status, offset=offset, limit=chunk, after=after))
+                cars = list(self._iter_car_rows(row_nums))
+            if not row_nums:
+                return
+            yield from cars
+            # Следующая порция продолжается после последней прочитанной строки
+            offset, after = 0, row_nums[-1]
+            if limit is not None:
+                limit -= len(row_nums)
+
+    def _iter_car_rows(self, row_nums: Iterable[int]) -> Iterator[Car]:
+        """ Ленивое чтение авто по номерам строк в cars. """
+        for row_car in self.cars_file.read_many(row_nums):
+            yield decode_car(row_car, self._trusted)
+
+    def find_cars_by_vin_prefix(self, prefix: str) -> Iterator[Car]:
+        """ Ленивый обход авто, VIN которых начинается с prefix (например, WMI
+        производителя), по возрастанию VIN. Диапазон читается из индекса по VIN. """
+        return self._iter_index_range('car_index', prefix, None, lambda vin: vin.startswith(prefix))
+
+    def find_cars_by_date_start(self, date_from: datetime | None = None,
+                                date_to: datetime | None = None) -> Iterator[Car]:
+        """ Ленивый обход авто с date_from <= date_start < date_to (None - без
+        границы) по возрастанию даты. Диапазон читается из индекса по дате. """
+        return self._iter_index_range('car_date_index', None if date_from is None else _date_key(date_from),
+                                      None if date_to is None else _date_key(date_to))
+
+    def _iter_index_range(self, index_name: str, lo: str | int | None, hi: str | int | None,
+                          accept: Callable[[str | int], bool] | None = None) -> Iterator[Car]:
+        """ Ленивый обход авто по диапазону ключей индекса cars (lo <= ключ < hi;
+        accept - обход идёт, пока ключ подходит). Как и iter_cars, записи
+        читаются порциями по ITER_CHUNK, блокировка на чтение берётся на порцию. """
+        after = None
+        while True:
+            with self._reading():
+                # Индекс берётся заново: при смене поколения он пересоздаётся
+                entries = list(itertools.islice(getattr(self, index_name).iter_range(lo, hi, after), ITER_CHUNK))
+                done = len(entries) < ITER_CHUNK
+                if accept is not None:
+                    matched = list(itertools.takewhile(lambda entry: accept(entry[0]), entries))
+                    done, entries = done or len(matched) < len(entries), matched
+                # Строки читаются по возрастанию смещения, авто выдаются в порядке ключей
+                row_nums = sorted(pif for _, pif in entries)
+                cars = dict(zip(row_nums, self._iter_car_rows(row_nums)))
+            yield from (cars[pif] for _, pif in entries)
+            if done:
+                return
+            after = entries[-1]
+
+    @timed
+    @reader
+    def get_cars_page(self, status: CarStatus, cursor: int | None = None,
+                      limit: int = 50) -> tuple[list[Car], int | None]:
+        """ Страница авто со статусом и курсор следующей страницы (None - страниц больше нет). """
+        row_nums = list(self.car_status_index.iter_key(status, limit=limit + 1, after=cursor))
+        has_next = len(row_nums) > limit
+        row_nums = row_nums[:limit]
+        cars = list(self._iter_car_rows(row_nums))
+        return cars, row_nums[-1] if has_next else None
+
     # Задание 4. Детальная информация
+    @timed
+    @reader
     def get_car_info(self, vin: str) -> CarFullInfo | None:
         """ Получение детальной информации об авто. """
-        rows_ci = self._r_file(self._format_path('cars_index.txt'))
+        info = self.car_info_cache.get(vin)
+        if info is not None:
+            # Копия, чтобы изменения у вызывающего не попали в кэш
+            return info.model_copy()
+
         # Номер строки в индексе по VIN
-        target_row_ci = -1
-        for row_ci in rows_ci:
-            row_ci_car_vin, row_ci_rnum = row_ci[0], row_ci[1]
-            if row_ci_car_vin == vin:
-                target_row_ci = int(row_ci_rnum)
-                break
-        if target_row_ci == -1:
+        target_row_ci = self._find_car_row(vin)
+        if target_row_ci is None:
             return None
         #raise ValueError(f'Авто с VIN-кодом "{vin}" не найден')
-        #print(f'Test: {target_row_ci}, Type of target_row_ci: {type(target_row_ci)}')
 
         # Получение данных об авто
-        with open(self._format_path('cars.txt'), 'r', encoding='utf-8') as fc:
-            fc.seek(target_row_ci * 502)
-            rows_cars = fc.readline()
-            row_car = rows_cars.strip().split(',')
-        # Получаем id модели, чтобы связать с models
-        model_id = int(row_car[1])
-
-        # Читаем индекс для определения из models по model_id
-        rows_mi = self._r_file(self._format_path('models_index.txt'))
-        target_row_mi = -1
-        for row_mi in rows_mi:
-            row_mi_id, row_mi_rnum = row_mi[0], row_mi[1]
-            if model_id == int(row_mi_id):
-                target_row_mi = int(row_mi_rnum)
-                break
-        if target_row_mi == -1:
+        car = self._read_car(target_row_ci)
+
+        # Модель по id модели авто
+        model = self._read_model(car.model)
+        if model is None:
             return None
             #raise ValueError('Модель с VIN-кодом "{vin}" не найдена')
 
-        with open(self._format_path('models.txt'), 'r', encoding='utf-8') as fm:
-            fm.seek(target_row_mi * 502)
-            rows_models = fm.readline()
-            row_model = rows_models.strip().split(',')
-
         # Проверка продажи авто
-        if  str(row_car[4]) != CarStatus.sold:
-            s_date = None
-            s_cost = None
-        else:
+        sale = None
+        if car.status == CarStatus.sold:
             # Ищем по индексу продажу
-            rows_si = self._r_file(self._format_path('sales_index.txt'))
-            target_row_si = -1
-            for row_si in rows_si:
-                row_si_car_vin, row_si_rnum = row_si[0],row_si[1]
-                if row_si_car_vin == vin:
-                    target_row_si = int(row_si_rnum)
-                    break
-            if target_row_si == -1:
+            target_row_si = self._find_sale_row(vin)
+            if target_row_si is None:
                 raise ValueError(f'Авто с VIN-кодом "{vin}" не найден')
 
             # Собираем информацию о продаже авто
-            with open(self._format_path('sales.txt'), 'r', encoding='utf-8') as fs:
-                fs.seek(target_row_si * 502)
-                rows_sales = fs.readline()
-                row_sales = rows_sales.strip().split(',')
-                s_date = datetime.strptime(row_sales[2], "%Y-%m-%d %H:%M:%S")
-                s_cost =Decimal(row_sales[3])
-
-        return CarFullInfo(
-            vin= str(row_car[0]),
-            car_model_name= str(row_model[1]),
-            car_model_brand= str(row_model[2]),
-            price= Decimal(row_car[2]),
-            date_start= datetime.strptime(row_car[3], "%Y-%m-%d %H:%M:%S"),
-            status= CarStatus(row_car[4]),
-            sales_date= s_date,
-            sales_cost= s_cost
-        )
+            sale = self._read_sale(target_row_si)
+
+        info = car_full_info(car, model, sale, self._trusted)
+        self.car_info_cache.put(vin, info)
+        return info.model_copy()
+
+    @timed
+    @reader
+    def get_car_info_many(self, vins: Iterable[str]) -> list[CarFullInfo | None]:
+        """ Детальная информация по списку VIN в порядке запроса (None - авто не найдено).
+        VIN ищутся по возрастанию, строки cars и sales читаются по возрастанию
+        смещения за один проход по каждому файлу, модели - один раз на модель. """
+        vins = list(vins)
+        infos: dict[str, CarFullInfo | None] = {}
+        # Номер строки в cars -> VIN для авто, которых нет в кэше
+        car_rows: dict[int, str] = {}
+        for vin in sorted(set(vins)):
+            info = self.car_info_cache.get(vin)
+            if info is not None:
+                infos[vin] = info
+                continue
+            target_row_ci = self._find_car_row(vin)
+            if target_row_ci is None:
+                infos[vin] = None
+            else:
+                car_rows[target_row_ci] = vin
+
+        target_rows = sorted(car_rows)
+        cars = list(self._iter_car_rows(target_rows))
+
+        # Продажи проданных авто: номер строки в sales -> VIN
+        sale_rows: dict[int, str] = {}
+        for car in cars:
+            if car.status == CarStatus.sold:
+                target_row_si = self._find_sale_row(car.vin)
+                if target_row_si is None:
+                    raise ValueError(f'Авто с VIN-кодом "{car.vin}" не найден')
+                sale_rows[target_row_si] = car.vin
+        sales: dict[str, Sale] = {}
+        for target_row_si, row_sale in zip(sorted(sale_rows), self.sales_file.read_many(sorted(sale_rows))):
+            sales[sale_rows[target_row_si]] = decode_sale(row_sale, self._trusted)
+
+        models = {model_id: self._read_model(model_id) for model_id in sorted({car.model for car in cars})}
+        for car in cars:
+            model = models[car.model]
+            if model is None:
+                infos[car.vin] = None
+                continue
+            info = car_full_info(car, model, sales.get(car.vin), self._trusted)
+            self.car_info_cache.put(car.vin, info)
+            infos[car.vin] = info
+
+        return [info.model_copy() if info is not None else None for info in (infos[vin] for vin in vins)]
 
     # Задание 5. Обновление ключевого поля
+    @timed
+    @writer
     def update_vin(self, vin: str, new_vin: str) -> Car:
         """ Обновление ключевого поля car_vin. """
-        rows_ci = self._r_file(self._format_path('cars_index.txt'))
         # Номер строки в индексе по VIN
-        target_row_ci = -1
-        for row_ci in rows_ci:
-            car_id, row_ci_num = row_ci[0], row_ci[1]
-            if car_id == vin:
-                target_row_ci = int(row_ci_num)
-                break
-        if target_row_ci == -1:
-            #return None
+        target_row_ci = self._find_car_row(vin)
+        if target_row_ci is None:
             raise ValueError(f'Авто с VIN-кодом "{vin}" не найдено')
         #print(target_row_ci)
 
         # Получаем данные об авто (с возможностью перезаписи)
-        with open(self._format_path('cars.txt'), 'r+', encoding='utf-8') as fc:
-            fc.seek(target_row_ci * 502)
-            rows_cars = fc.readline()
-            row_car = rows_cars.strip().split(',')
-            # Обновляем ключ = VIN
-            row_car[0] = new_vin
-
-            # перезаписываем строку в cars
-            fc.seek(target_row_ci * 502)
-            row_car_upd = ','.join(row_car).ljust(500) + '\n'
-            fc.write(row_car_upd)
-
-        # Обновляем и сортируем индекс (car_id = VIN)
-        for ci in self.car_index:
-            if ci.car_id == vin:
-                ci.car_id = new_vin
-
-        self.car_index.sort(key=lambda x: x.car_id)
-
-        # Перезаписываем файл с индексами cars_index по ключевому полю car_id - VIN
-        self._rw_file(self._format_path('cars_index.txt'),
-                         data=[[str(current_ci.car_id),
-                                str(current_ci.pif_cars)] for current_ci in self.car_index],
-                         ljust_par=50)
-
-        car = Car(
-            vin=new_vin,
-            model=int(row_car[1]),
-            price=Decimal(row_car[2]),
-            date_start=datetime.strptime(row_car[3], "%Y-%m-%d %H:%M:%S"),
-            status=CarStatus(row_car[4])
-            )
-
-        return car
+        row_car = self.cars_file.read_fields(target_row_ci)
+        # Обновляем ключ = VIN
+        row_car[0] = new_vin
+
+        # Продажи авто переходят на новый VIN вместе с ним: иначе продажа
+        # не относится ни к одному авто и выпадает из отчётов
+        sale_rows = self.sale_index.find_all(vin)
+        rows_sales = [','.join([row_sale[0], new_vin] + row_sale[2:4])
+                      for row_sale in self.sales_file.read_many(sale_rows)]
+
+        # перезаписываем строку в cars и строки продаж в sales
+        data_car, *data_sales = self._begin('update_vin', [('cars', target_row_ci, ','.join(row_car))]
+                                            + [('sales', row_num, row) for row_num, row in zip(sale_rows, rows_sales)])
+        self.cars_file.write(target_row_ci, data_car)
+        if sale_rows:
+            self.sales_file.write_many(zip(sale_rows, data_sales))
+            self.sale_index.apply([(vin, row_num) for row_num in sale_rows],
+                                  [(new_vin, row_num) for row_num in sale_rows])
+            for row_num in sale_rows:
+                self.sale_cache.invalidate(row_num)
+
+        # Обновляем ключ в индексе (car_id = VIN)
+        self.car_index.rename(vin, new_vin, target_row_ci)
+        self._invalidate_car(target_row_ci, vin, new_vin)
+
+        return decode_car(row_car, self._trusted)
 
     # Задание 6. Удаление продажи
+    @timed
+    @writer
     def revert_sale(self, sales_number: str) -> Car:
         """ Отмена продажи авто. """
-        # 1. Читаем файл продаж, чтобы найти vin и номер строки на удаление
-        vin = None
-
-        target_row_del = -1
-        with open(self._format_path('sales.txt'), 'r', encoding='utf-8') as fsd:
-            rows_sales = fsd.readlines()  # Читаем строки сразу
-            for line_number, line in enumerate(rows_sales):
-                sales_num, car_vin, _, _ = line.strip().split(',')
-                if sales_num == sales_number:
-                    vin = car_vin
-                    target_row_del = line_number  # Сохраняем номер строки
-                    break
-        if target_row_del == -1:
-            raise ValueError(f'Авто с VIN-кодом "{vin}" не продан')
+        # 1. Ищем по индексу номер строки на удаление и читаем vin
+        target_row_del = self.sales_number_index.find(sales_number)
+        if target_row_del is None:
+            raise ValueError(f'Продажа с номером "{sales_number}" не найдена')
+        row_sale = self.sales_file.read_fields(target_row_del)
+        vin = row_sale[1]
 
         # 2. Обновляем статус авто. Ищем по индексу.
-        rows_ci = self._r_file(self._format_path('cars_index.txt'))
-        # Номер строки в индексе по VIN
-        row_ci = -1
-        for row_ci in rows_ci:
-            car_id, row_ci_num = row_ci[0], row_ci[1]
-            if car_id == vin:
-                row_ci = int(row_ci_num)
-                break
-        if row_ci == -1:
-            #return None
+        row_ci = self._find_car_row(vin)
+        if row_ci is None:
             raise ValueError(f'Авто с VIN-кодом "{vin}" не найден')
 
         # Обновляем статус для авто и перезаписываем строку в файле cars
-        with open(self._format_path('cars.txt'), 'r+', encoding='utf-8') as fc:
-            fc.seek(row_ci * 502)
-            rows_cars = fc.readline()
-            row_car = rows_cars.strip().split(',')
-
-            car = Car(
-                vin=str(row_car[0]),
-                model=int(row_car[1]),
-                price=Decimal(row_car[2]),
-                date_start=datetime.strptime(row_car[3], "%Y-%m-%d %H:%M:%S"),
-                status=CarStatus(row_car[4])
-            )
-
-            car.status = CarStatus.available
-            row_car_upd = f'{car.vin},{car.model},{car.price},{car.date_start},{car.status}'.ljust(500) + '\n'
-            fc.seek(row_ci * 502)
-            fc.write(row_car_upd)
-
-        # Удаляем запись из продаж
-        with open(self._format_path('sales.txt'), 'w', encoding='utf-8') as fsd:
-            for row_sale_rnum, row_sale in enumerate(rows_sales):
-                if row_sale_rnum != target_row_del:  # Пропускаем строку с удаляемой продажей
-                    fsd.write(row_sale)
-
-        # Считываем продажи, чтобы перезаписать отсортированный индекс
-        with open(self._format_path('sales.txt'), 'r', encoding='utf-8') as fsd:
-            sale_lines = fsd.readlines()
-
-        new_sales_index = []
-
-        for row_sale_rnum, row_sale in enumerate(sale_lines):
-            _, car_vin, _, _ = row_sale.strip().split(',')
-            new_sales_index.append((car_vin, row_sale_rnum))
-
-        new_sales_index.sort(key=lambda x: x[0])
-
-        #self._rw_file(self._format_path('sales_index.txt'), data=[new_sales_index], ljust_par=50)
-        with open(self._format_path('sales_index.txt'), 'w', encoding='utf-8') as fsi:
-            for car_vin, row_sale_rnum in new_sales_index:
-                fsi.write(f'{car_vin},{row_sale_rnum}'.ljust(50) +'\n')
+        row_car = self.cars_file.read_fields(row_ci)
+
+        car = decode_car(row_car, self._trusted)
+
+        old_status = car.status
+        car.status = CarStatus.available
+        row_car_upd = encode_car(car)
+        row_sale_del = ','.join(row_sale[:4] + [FLG_DEL])
+        data_car, data_sale = self._begin('revert_sale', [('cars', row_ci, row_car_upd),
+                                                          ('sales', target_row_del, row_sale_del)])
+        self.cars_file.write(row_ci, data_car)
+
+        self.car_status_index.rename(old_status, car.status, row_ci)
+        self._invalidate_car(row_ci, vin)
+        self.model_sales.update([(car.model, -1)])
+
+        # Помечаем продажу удалённой на месте: строку займёт следующая продажа или уберёт compact()
+        self.sales_file.write(target_row_del, data_sale)
+        self.sale_index.remove(vin, target_row_del)
+        self.sales_number_index.remove(sales_number, target_row_del)
+        self.free_index.add('sales', target_row_del)
+        self.sale_cache.invalidate(target_row_del)
 
         return car
 
+    def _allocate_rows(self, name: str, data_file: RecordFile, count: int) -> list[int]:
+        """ Номера строк под count новых записей: сначала свободные строки файла, затем конец файла. """
+        free_rows = list(self.free_index.iter_key(name, limit=count))
+        end = len(data_file)
+        return free_rows + list(range(end, end + count - len(free_rows)))
+
+    def _store_rows(self, name: str, data_file: RecordFile, row_nums: list[int], rows: list[bytes]) -> None:
+        """ Запись новых строк по номерам из _allocate_rows: свободные строки
+        перезаписываются на месте и уходят из списка свободных, остальные дописываются. """
+        end = len(data_file)
+        reused = [(row_num, row) for row_num, row in zip(row_nums, rows) if row_num < end]
+        if reused:
+            data_file.write_many(reused)
+            self.free_index.apply([(name, row_num) for row_num, _ in reused], [])
+        if len(reused) < len(rows):
+            data_file.append(row for row_num, row in zip(row_nums, rows) if row_num >= end)
+
+    @timed
+    def compact(self) -> int:
+        """ Удаление отменённых продаж из sales и перестроение индексов продаж.
+        Новый файл и снимки индексов строятся под блокировкой на чтение, поэтому
+        чтения продолжаются; на запись блокировка берётся только для подмены
+        файлов. Если за это время данные изменились, сжатие повторяется под
+        блокировкой на запись. Возвращает число удалённых строк. """
+        with self._compact_lock:
+            with self._reading():
+                generation = self._generation
+                prepared = self._prepare_compact()
+            with self._writing():
+                if self._generation != generation:
+                    self._discard_compact(prepared)
+                    prepared = self._prepare_compact()
+                if prepared is None:
+                    return 0
+                removed, sales_path, sale_index_path, sales_number_index_path = prepared
+                # Записи журнала ссылаются на старые номера строк sales, поэтому перед
+                # сжатием журнал очищается; сама запись о сжатии пуста - после сбоя
+                # индексы перестраиваются по файлам данных
+                self._checkpoint()
+                self._begin('compact', [])
+                self.sales_file.replace_with(sales_path)
+                self.sale_index.replace_with(sale_index_path)
+                self.sales_number_index.replace_with(sales_number_index_path)
+                self.free_index.replace_all([entry for entry in self.free_index if entry[0] != 'sales'])
+                self.sale_cache.clear()
+                self._snapshot = None
+                return removed
+
+    def compact_in_background(self) -> Future:
+        """ Запуск compact в отдельном потоке. Future вернёт число удалённых строк. """
+        future: Future = Future()
+
+        def run() -> None:
+            try:
+                future.set_result(self.compact())
+            except BaseException as exc:
+                future.set_exception(exc)
+        threading.Thread(target=run, name='bibip-compact', daemon=True).start()
+        return future
+
+    def _prepare_compact(self) -> tuple[int, str, str, str] | None:
+        """ Сжатый файл sales и снимки индексов продаж рядом с текущими.
+        None - удалять нечего. """
+        rows_sales = [row_sale for _, row_sale in self._iter_active_sales()]
+        removed = len(self.sales_file) - len(rows_sales)
+        if not removed:
+            return None
+        # Номера строк сдвигаются, поэтому индексы строятся заново
+        return (removed,
+                self.sales_file.write_copy(','.join(row_sale) for row_sale in rows_sales),
+                self.sale_index.write_copy(sorted((row_sale[1], row_num)
+                                                  for row_num, row_sale in enumerate(rows_sales))),
+                self.sales_number_index.write_copy(sorted((row_sale[0], row_num)
+                                                          for row_num, row_sale in enumerate(rows_sales))))
+
+    @staticmethod
+    def _discard_compact(prepared: tuple[int, str, str, str] | None) -> None:
+        """ Удаление файлов устаревшей подготовки сжатия (уже удалённые пропускаются). """
+        if prepared is not None:
+            for path in prepared[1:]:
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+
+    @timed
+    @writer
+    def migrate(self, record_format: Literal['text', 'packed']) -> None:
+        """ Перевод файлов данных в другой формат строк.
+        Номера строк не меняются, поэтому индексы остаются верными. """
+        self._checkpoint()
+        for name, data_file in (('models', self.models_file), ('cars', self.cars_file), ('sales', self.sales_file)):
+            new_format = get_format(record_format, name)
+            if data_file.format is not new_format:
+                data_file.rewrite((','.join(row) for row in data_file.iter_rows()), new_format)
+                # Файл подменён - другие процессы должны открыть его заново
+                self._changed = True
+        self.record_format = record_format
+
+    @timed
+    @reader
+    def snapshot(self) -> Snapshot:
+        """ Колоночный снимок cars и sales в массивах NumPy (нужен numpy).
+        Снимок кэшируется; следующий вызов дочитывает только новые строки
+        и перечитывает изменённые. """
+        return self._current_snapshot()
+
+    def _current_snapshot(self) -> Snapshot:
+        """ Снимок, доведённый до текущих файлов (вызывается под блокировкой на чтение). """
+        with self._snapshot_lock:
+            if self._snapshot is None:
+                self._snapshot = Snapshot.build(self.cars_file, self.sales_file)
+            else:
+                self._snapshot = self._snapshot.refresh(self.cars_file, self.sales_file, self._snapshot_dirty)
+            for dirty in self._snapshot_dirty.values():
+                dirty.clear()
+            return self._snapshot
+
+    @timed
+    @reader
+    def get_sale(self, sales_number: str) -> Sale | None:
+        """ Получение продажи по номеру (бинарный поиск по индексу). """
+        target_row = self.sales_number_index.find(sales_number)
+        if target_row is None:
+            return None
+        return self._read_sale(target_row).model_copy()
+
     # Задание 7. Самые продаваемые модели
-    def top_models_by_sales(self) -> list[ModelSaleStats]:
-        """ ТОП-3 самых продаваемых моделей. """
-        # Поиск авто по vin и формирование списка
-        with open(self._format_path('sales_index.txt'), 'r', encoding='utf-8') as fs:
-            rows_sales:list[str] = fs.readlines()
-        car_vin_list = []
-        for s_line in rows_sales:
-            car_vin, _ = s_line.strip().split(',')
-            car_vin_list.append(car_vin)
-
-        model_id_list = []
-        for item in car_vin_list:
-            with open(self._format_path('cars_index.txt'), 'r', encoding='utf-8') as fci:
-                index_lines: list[str] = fci.readlines()
-                target_string = -1
-                for ci_line in index_lines:
-                    car_vin, line_number = ci_line.strip().split(',')
-                    if car_vin == item:
-                        target_string = int(line_number)
-                        break
-            with open(self._format_path('cars.txt'), 'r+', encoding='utf-8') as fc:
-                fc.seek(target_string * 502)
-                rows_cars = fc.readline()
-                row_car = rows_cars.strip().split(',')
-                model_id_list.append(row_car[1])
-
-        # ТОП-3 модели по количеству продаж. Записываем в ModelSaleStats
-        top_models = dict(Counter(model_id_list))
-        top_3_models = sorted(top_models.items(), key=lambda x: x[1], reverse=True)[:3]
-
-        res_top_3 = []
-        for model_id, sales_number in top_3_models:
-            model_info = self._get_model_info(model_id)
-            res_top_3.append(ModelSaleStats(car_model_name=str(model_info.name),
-                                        brand=model_info.brand,
-                                        sales_number=sales_number))
-
-        return res_top_3
+    @timed
+    @reader
+    def top_models_by_sales(self, n: int = 3, since: datetime | None = None, until: datetime | None = None,
+                            by: Literal['count', 'revenue'] = 'count') -> list[ModelSaleStats]:
+        """ ТОП-n самых продаваемых моделей (по умолчанию ТОП-3 по числу продаж).
+        since/until - окно по дате продажи [since, until),
+        by - упорядочивание по числу продаж или по сумме продаж. """
+        if by not in ('count', 'revenue'):
+            raise ValueError(f'Неизвестный критерий "{by}"')
+
+        if by == 'count' and since is None and until is None:
+            # ТОП-n модели по счётчикам продаж
+            top_models = [(model_id, sales_number, None) for model_id, sales_number in self.model_sales.top(n)]
+        else:
+            top_models = self._aggregate_sales(n, since, until, by)
+
+        # Записываем в ModelSaleStats
+        res_top = []
+        for model_id, sales_number, revenue in top_models:
+            model_info = self._read_model(model_id)
+            if model_info is None:
+                raise ValueError('ID модели снет найден в продажах')
+            res_top.append(ModelSaleStats(car_model_name=str(model_info.name),
+                                          brand=model_info.brand,
+                                          sales_number=sales_number,
+                                          revenue=revenue))
+
+        return res_top
+
+    def _aggregate_sales(self, n: int, since: datetime | None, until: datetime | None,
+                         by: str) -> list[tuple[int, int, Decimal]]:
+        """ Число и сумма продаж по моделям за окно - по колоночному снимку:
+        повторный отчёт дочитывает в снимок только строки, изменённые с прошлого раза. """
+        stats = self._current_snapshot().model_sales(None if since is None else _utc(since),
+                                                     None if until is None else _utc(until))
+        sort_key = 1 if by == 'count' else 2
+        return heapq.nlargest(n, stats, key=itemgetter(sort_key))
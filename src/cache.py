@@ -0,0 +1,58 @@
+"""Кэш Bibip
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+
+class LRUCache:
+    """ Ограниченный кэш с вытеснением давно не использованных записей.
+    maxsize = 0 отключает кэш. Считает попадания и промахи.
+    Операции защищены своей блокировкой: кэш читают параллельные читатели. """
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        """ Значение по ключу или None; при попадании запись становится самой свежей. """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """ Сохранение значения с вытеснением самой старой записи. """
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """ Удаление записи по ключу. """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """ Удаление всех записей. """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        """ Счётчики попаданий и промахов. """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
@@ -0,0 +1,61 @@
+"""Кодирование и разбор строк данных Bibip
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from models import Car, CarFullInfo, CarStatus, Model, Sale
+
+# Статус по тексту поля без создания CarStatus на каждую строку
+STATUSES = {str(status): status for status in CarStatus}
+
+
+def encode_model(model: Model) -> str:
+    """ Строка models: id,name,brand. """
+    return f'{model.id},{model.name},{model.brand}'
+
+
+def encode_car(car: Car) -> str:
+    """ Строка cars: vin,model,price,date_start,status. """
+    return f'{car.vin},{car.model},{car.price},{car.date_start},{car.status}'
+
+
+def encode_sale(sale: Sale) -> str:
+    """ Строка sales: sales_number,car_vin,sales_date,cost. """
+    return f'{sale.sales_number},{sale.car_vin},{sale.sales_date},{sale.cost}'
+
+
+def decode_model(fields: list[str], trusted: bool = True) -> Model:
+    """ Модель из полей строки models.
+    trusted - строку записал сам сервис: объект собирается через model_construct
+    без проверок pydantic, даты разбираются fromisoformat. Иначе поля
+    разбирает и проверяет pydantic. """
+    if trusted:
+        return Model.model_construct(id=int(fields[0]), name=fields[1], brand=fields[2])
+    return Model(id=fields[0], name=fields[1], brand=fields[2])
+
+
+def decode_car(fields: list[str], trusted: bool = True) -> Car:
+    """ Авто из полей строки cars. """
+    if trusted:
+        return Car.model_construct(vin=fields[0], model=int(fields[1]), price=Decimal(fields[2]),
+                                   date_start=datetime.fromisoformat(fields[3]), status=STATUSES[fields[4]])
+    return Car(vin=fields[0], model=fields[1], price=fields[2], date_start=fields[3], status=fields[4])
+
+
+def decode_sale(fields: list[str], trusted: bool = True) -> Sale:
+    """ Продажа из полей строки sales (пометка удаления не входит в Sale). """
+    if trusted:
+        return Sale.model_construct(sales_number=fields[0], car_vin=fields[1],
+                                    sales_date=datetime.fromisoformat(fields[2]), cost=Decimal(fields[3]))
+    return Sale(sales_number=fields[0], car_vin=fields[1], sales_date=fields[2], cost=fields[3])
+
+
+def car_full_info(car: Car, model: Model, sale: Sale | None, trusted: bool = True) -> CarFullInfo:
+    """ Детальная информация об авто по авто, его модели и продаже. """
+    values = dict(vin=car.vin, car_model_name=model.name, car_model_brand=model.brand,
+                  price=car.price, date_start=car.date_start, status=car.status,
+                  sales_date=sale.sales_date if sale is not None else None,
+                  sales_cost=sale.cost if sale is not None else None)
+    if trusted:
+        return CarFullInfo.model_construct(**values)
+    return CarFullInfo(**values)
@@ -0,0 +1,563 @@
+"""Индексы Bibip
+   pos_in_file = pif
+"""
+
+import bisect
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections.abc import Callable, Iterator
+from sortedcontainers import SortedList
+from metrics import active_metrics
+from storage import write_temp
+
+# Ширина строки индекса в символах (без перевода строки)
+INDEX_ROW_WIDTH = 50
+# Длина строки индекса в байтах: 50 символов + перевод строки
+# (в текстовом режиме '\n' пишется как os.linesep, на Windows это 2 байта)
+INDEX_ROW_LEN = INDEX_ROW_WIDTH + len(os.linesep)
+
+# Заголовок снимка индекса: метка, версия, вид ключа (0 - str, 1 - int),
+# ширина ключа в байтах, число записей, эпоха снимка
+SNAPSHOT_MAGIC = b'BIBIPIDX'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<8sBBxxIQQ')
+# Сдвиг целого ключа: big-endian байты сдвинутого числа сравниваются как числа
+INT_KEY_BIAS = 1 << 63
+
+
+class _FixedKeys:
+    """ Отсортированные ключи фиксированной ширины в буфере (отображение
+    снимка или bytearray), доступные по номеру (для bisect). """
+    __slots__ = ('buf', 'start', 'width', 'count')
+
+    def __init__(self, buf: mmap.mmap | bytearray, start: int, width: int, count: int) -> None:
+        self.buf = buf
+        self.start = start
+        self.width = width
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        offset = self.start + i * self.width
+        return self.buf[offset:offset + self.width]
+
+
+class PackedEntries:
+    """ Отсортированный набор пар (ключ, pif) без объекта на запись.
+    Записи лежат блоками до CHUNK_SIZE: ключи - подряд в bytearray
+    фиксированной ширины (байты ключа, дополненные нулями), pif - в
+    параллельном array('q'). Запись стоит width + 8 байт против сотни с
+    лишним у кортежа со строкой; вставка и удаление сдвигают только свой
+    блок. Ширина растёт вместе с самым длинным ключом.
+    """
+    CHUNK_SIZE = 1024
+    __slots__ = ('encode_key', 'decode_key', 'width', '_keys', '_pifs', '_maxes', '_len')
+
+    def __init__(self, encode_key: Callable[[str | int], bytes], decode_key: Callable[[bytes], str | int]) -> None:
+        self.encode_key = encode_key
+        self.decode_key = decode_key
+        self.width = 0
+        self._keys: list[bytearray] = []
+        self._pifs: list[array] = []
+        # Последняя запись каждого блока (байты ключа, pif) - для выбора блока
+        self._maxes: list[tuple[bytes, int]] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self.iter_from()
+
+    def iter_from(self, entry: tuple | None = None) -> Iterator[tuple]:
+        """ Записи не меньше entry (все при None) по возрастанию. """
+        chunk, pos = (0, 0) if entry is None else self._find(entry)[:2]
+        width, decode_key = self.width, self.decode_key
+        while chunk < len(self._pifs):
+            keys, pifs = self._keys[chunk], self._pifs[chunk]
+            for i in range(pos, len(pifs)):
+                yield decode_key(bytes(keys[i * width:(i + 1) * width])), pifs[i]
+            chunk, pos = chunk + 1, 0
+
+    def _probe(self, key: str | int) -> bytes:
+        """ Ключ в байтах, дополненный до ширины. """
+        return self.encode_key(key).ljust(self.width, b'\0')
+
+    def _position(self, chunk: int, probe: bytes, pif: int) -> int:
+        """ Место записи в блоке (бинарный поиск по ключу, затем по pif). """
+        keys = _FixedKeys(self._keys[chunk], 0, self.width, len(self._pifs[chunk]))
+        lo, hi = bisect.bisect_left(keys, probe), bisect.bisect_right(keys, probe)
+        return bisect.bisect_left(self._pifs[chunk], pif, lo, hi)
+
+    def _find(self, entry: tuple) -> tuple[int, int, bool]:
+        """ Блок и место записи; третий элемент - есть ли запись. """
+        key, pif = entry
+        probe = self._probe(key)
+        chunk = bisect.bisect_left(self._maxes, (probe, pif))
+        if chunk == len(self._maxes):
+            return chunk, 0, False
+        pos = self._position(chunk, probe, pif)
+        pifs, width = self._pifs[chunk], self.width
+        return chunk, pos, pos < len(pifs) and pifs[pos] == pif and \
+            self._keys[chunk][pos * width:(pos + 1) * width] == probe
+
+    def __contains__(self, entry: tuple) -> bool:
+        return self._find(entry)[2]
+
+    def _widen(self, width: int) -> None:
+        """ Перепаковка ключей под большую ширину. """
+        old = self.width
+        self._keys = [bytearray(b''.join(bytes(keys[i:i + old]).ljust(width, b'\0')
+                                         for i in range(0, len(keys), old))) if old else
+                      bytearray(width * len(keys_pifs)) for keys, keys_pifs in zip(self._keys, self._pifs)]
+        self._maxes = [(key.ljust(width, b'\0'), pif) for key, pif in self._maxes]
+        self.width = width
+
+    def add(self, entry: tuple) -> None:
+        """ Вставка записи на своё место. """
+        key, pif = entry
+        size = len(self.encode_key(key))
+        if size > self.width:
+            self._widen(size)
+        probe, width = self._probe(key), self.width
+        if not self._maxes:
+            self._keys.append(bytearray())
+            self._pifs.append(array('q'))
+            self._maxes.append((probe, pif))
+        chunk = min(bisect.bisect_left(self._maxes, (probe, pif)), len(self._maxes) - 1)
+        pos = self._position(chunk, probe, pif)
+        keys, pifs = self._keys[chunk], self._pifs[chunk]
+        keys[pos * width:pos * width] = probe
+        pifs.insert(pos, pif)
+        self._len += 1
+        if len(pifs) > self.CHUNK_SIZE:
+            # Переполненный блок делится пополам
+            half = len(pifs) // 2
+            self._keys[chunk:chunk + 1] = [keys[:half * width], keys[half * width:]]
+            self._pifs[chunk:chunk + 1] = [pifs[:half], pifs[half:]]
+            self._maxes[chunk:chunk + 1] = [None, None]
+            self._update_max(chunk)
+            self._update_max(chunk + 1)
+        else:
+            self._update_max(chunk)
+
+    def _update_max(self, chunk: int) -> None:
+        """ Обновление последней записи блока. """
+        keys, pifs = self._keys[chunk], self._pifs[chunk]
+        self._maxes[chunk] = (bytes(keys[-self.width:]) if self.width else b'', pifs[-1])
+
+    def remove(self, entry: tuple) -> None:
+        """ Удаление записи; ValueError, если её нет. """
+        chunk, pos, found = self._find(entry)
+        if not found:
+            raise ValueError(f'Записи {entry} нет в наборе')
+        keys, pifs, width = self._keys[chunk], self._pifs[chunk], self.width
+        del keys[pos * width:(pos + 1) * width]
+        del pifs[pos]
+        self._len -= 1
+        if pifs:
+            self._update_max(chunk)
+        else:
+            del self._keys[chunk], self._pifs[chunk], self._maxes[chunk]
+
+    def rename(self, key: str | int, new_key: str | int, pif: int) -> None:
+        """ Замена ключа у записи (смена VIN). """
+        self.remove((key, pif))
+        self.add((new_key, pif))
+
+    def iter_key(self, key: str | int, first: int = 0) -> Iterator[int]:
+        """ Номера строк с ключом не меньше first, по возрастанию. """
+        probe = self._probe(key)
+        chunk = bisect.bisect_left(self._maxes, (probe, first))
+        while chunk < len(self._maxes):
+            pifs = self._pifs[chunk]
+            keys = _FixedKeys(self._keys[chunk], 0, self.width, len(pifs))
+            lo, hi = bisect.bisect_left(keys, probe), bisect.bisect_right(keys, probe)
+            yield from pifs[bisect.bisect_left(pifs, first, lo, hi):hi]
+            if hi < len(pifs):
+                return
+            chunk += 1
+
+
+def _without(entries: Iterator[tuple], removed: Iterator[tuple]) -> Iterator[tuple]:
+    """ Отсортированные записи без записей removed (тоже отсортированных). """
+    skip = next(removed, None)
+    for entry in entries:
+        while skip is not None and skip < entry:
+            skip = next(removed, None)
+        if entry != skip:
+            yield entry
+
+
+class FileIndex:
+    """ Отсортированный индекс «ключ -> номер строки в файле данных».
+    Основа индекса - двоичный снимок (*_index.bin): массив pif (int64)
+    и массив ключей фиксированной ширины, отсортированные по (ключ, pif).
+    Снимок отображается в память и не разбирается: поиск идёт бинарным
+    поиском прямо по отображению, поэтому открытие индекса стоит O(1),
+    а процессы делят страницы снимка через страничный кэш.
+    Изменения дописываются в журнал (*_index.delta) строками вида «+,ключ,pif»
+    или «-,ключ,pif» и в памяти лежат поверх снимка в плотных наборах
+    PackedEntries (added/removed); когда журнал вырастает до доли от
+    размера индекса, снимок перезаписывается целиком. Снимок и журнал загружаются при первом
+    обращении к индексу; refresh() подхватывает изменения другого процесса,
+    дочитывая только новые строки журнала. Текстовый *_index.txt прежних
+    версий переводится в снимок при первой загрузке.
+    """
+    def __init__(self, path: str, key_type: type = str, merge_threshold: int = 1024) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        self.snapshot_path = os.path.splitext(path)[0] + '.bin'
+        self.delta_path = os.path.splitext(path)[0] + '.delta'
+        # Metrics для счётчиков ввода-вывода (None - не считать)
+        self.metrics = None
+        self.key_type = key_type
+        self.merge_threshold = merge_threshold
+        # Записи журнала поверх снимка (added/removed) задаёт _reset()
+        self._load_lock = threading.Lock()
+        # Есть ли изменения, ещё не сброшенные на диск через sync()
+        self.unsynced = False
+        self._reset()
+
+    def _reset(self) -> None:
+        """ Сброс загруженного состояния: индекс загрузится заново при обращении. """
+        self.added = PackedEntries(self._encode_key, self._decode_key)
+        self.removed = PackedEntries(self._encode_key, self._decode_key)
+        self.delta_size = 0
+        self.epoch = 0
+        self._keys: _FixedKeys | None = None
+        self._pifs: memoryview | tuple = ()
+        # Файл отображённого снимка (inode, mtime, размер) и прочитанная часть журнала в байтах
+        self._snapshot_id: tuple[int, int, int] | None = None
+        self._delta_offset = 0
+        self._loaded = False
+
+    def _count(self, **counts: int) -> None:
+        """ Учёт ввода-вывода, если метрики включены. """
+        metrics = active_metrics(self.metrics)
+        if metrics is not None:
+            metrics.count(self.name, **counts)
+
+    def _ensure(self) -> None:
+        """ Загрузка снимка и журнала при первом обращении. """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self) -> None:
+        """ Отображение снимка и применение журнала изменений. """
+        if not os.path.exists(self.snapshot_path):
+            if os.path.exists(self.path) or os.path.exists(self.delta_path):
+                self._load_text()
+            return
+        self._map()
+        self._read_delta()
+
+    def _read_delta(self) -> None:
+        """ Применение строк журнала изменений, дописанных после уже прочитанных. """
+        if not os.path.exists(self.delta_path):
+            return
+        with open(self.delta_path, 'rb') as f:
+            f.seek(self._delta_offset)
+            data = f.read()
+        # Берутся только целые строки: журнал может дописываться прямо сейчас
+        data = data[:data.rfind(b'\n') + 1]
+        self._count(file_opens=1, bytes_read=len(data))
+        rows = data.decode('utf-8').splitlines()
+        if self._delta_offset == 0 and rows:
+            header = rows.pop(0)
+            # Журнал мог пережить перезапись снимка (сбой между заменой снимка и удалением
+            # журнала) - тогда его эпоха старше снимка и записи уже в снимке
+            if not header.startswith('#') or int(header[2:]) != self.epoch:
+                rows = []
+        self._delta_offset += len(data)
+        for row in rows:
+            entry = self._parse(row[2:])
+            if row[0] == '+':
+                if entry in self.removed:
+                    self.removed.remove(entry)
+                else:
+                    self.added.add(entry)
+            elif entry in self.added:
+                self.added.remove(entry)
+            else:
+                self.removed.add(entry)
+        self._count(rows_decoded=len(rows))
+        self.delta_size += len(rows)
+
+    def refresh(self) -> None:
+        """ Подхват изменений, сделанных другим процессом. Если снимок не менялся,
+        дочитываются только новые строки журнала; иначе индекс сбрасывается
+        и загрузится заново при следующем обращении. """
+        with self._load_lock:
+            if not self._loaded:
+                return
+            try:
+                stat = os.stat(self.snapshot_path)
+            except FileNotFoundError:
+                stat = None
+            delta_size = os.path.getsize(self.delta_path) if os.path.exists(self.delta_path) else 0
+            if (stat is None or (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._snapshot_id
+                    or delta_size < self._delta_offset):
+                self._reset()
+            elif delta_size > self._delta_offset:
+                self._read_delta()
+
+    def _load_text(self) -> None:
+        """ Перевод индекса прежнего текстового формата (основной файл и журнал) в снимок. """
+        entries = SortedList()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries.update(self._parse(row) for row in f)
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, 'r', encoding='utf-8') as f:
+                for row in f:
+                    if row.startswith('#'):
+                        continue
+                    op, entry = row[0], self._parse(row[2:])
+                    if op == '+':
+                        if entry not in entries:
+                            entries.add(entry)
+                    else:
+                        entries.discard(entry)
+        self._replace(entries)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _map(self) -> None:
+        """ Отображение файла снимка в память. """
+        with open(self.snapshot_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        self._snapshot_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._count(file_opens=1)
+        magic, version, key_kind, width, count, epoch = SNAPSHOT_HEADER.unpack_from(mm)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or key_kind != (self.key_type is int):
+            raise ValueError(f'Неизвестный формат снимка индекса {self.snapshot_path}')
+        keys_start = SNAPSHOT_HEADER.size + count * 8
+        if len(mm) < keys_start + count * width:
+            raise ValueError(f'Снимок индекса {self.snapshot_path} обрезан')
+        # Старые отображения не закрываются явно: их ещё могут читать начатые обходы
+        self._pifs = memoryview(mm)[SNAPSHOT_HEADER.size:keys_start].cast('q')
+        self._keys = _FixedKeys(mm, keys_start, width, count)
+        self.epoch = epoch
+
+    def _parse(self, row: str) -> tuple:
+        """ Разбор строки индекса «ключ,pif». """
+        key, pif = row.strip().rsplit(',', 1)
+        return self.key_type(key), int(pif)
+
+    def _encode_key(self, key: str | int) -> bytes:
+        """ Ключ в байтах снимка: порядок байт совпадает с порядком ключей. """
+        if self.key_type is int:
+            return (key + INT_KEY_BIAS).to_bytes(8, 'big')
+        return key.encode('utf-8')
+
+    def _decode_key(self, data: bytes) -> str | int:
+        """ Ключ из байтов снимка. """
+        if self.key_type is int:
+            return int.from_bytes(data, 'big') - INT_KEY_BIAS
+        return data.rstrip(b'\0').decode('utf-8')
+
+    def _snapshot_range(self, key: str | int) -> tuple[int, int]:
+        """ Границы записей с ключом в снимке. """
+        if self._keys is None:
+            return 0, 0
+        # Короткие ключи лежат в снимке дополненными нулями до ширины
+        probe = self._encode_key(key).ljust(self._keys.width, b'\0')
+        return bisect.bisect_left(self._keys, probe), bisect.bisect_right(self._keys, probe)
+
+    def _in_snapshot(self, key: str | int, pif: int) -> bool:
+        """ Есть ли запись в снимке (без учёта журнала). """
+        lo, hi = self._snapshot_range(key)
+        pos = bisect.bisect_left(self._pifs, pif, lo, hi)
+        return pos < hi and self._pifs[pos] == pif
+
+    def __len__(self) -> int:
+        self._ensure()
+        return len(self._pifs) - len(self.removed) + len(self.added)
+
+    def __iter__(self) -> Iterator[tuple]:
+        """ Обход всех записей (ключ, pif) по возрастанию. """
+        self._ensure()
+        keys, pifs, removed = self._keys, self._pifs, set(self.removed)
+        snapshot = ((self._decode_key(keys[i]), pifs[i]) for i in range(len(pifs)))
+        if removed:
+            snapshot = (entry for entry in snapshot if entry not in removed)
+        return heapq.merge(snapshot, self.added)
+
+    def find(self, key: str | int) -> int | None:
+        """ Номер строки по ключу (бинарный поиск по снимку и журналу). """
+        return next(self.iter_key(key), None)
+
+    def find_all(self, key: str | int) -> list[int]:
+        """ Номера строк всех записей с ключом, по возрастанию. """
+        return list(self.iter_key(key))
+
+    def iter_key(self, key: str | int, offset: int = 0, limit: int | None = None,
+                 after: int | None = None) -> Iterator[int]:
+        """ Ленивый обход номеров строк с ключом, по возрастанию.
+        after - номер строки, после которой продолжить (курсор),
+        offset и limit считаются от начала (или от курсора); если журнал
+        не трогал ключ - за O(log n). """
+        self._ensure()
+        first = 0 if after is None else after + 1
+        pifs = self._pifs
+        lo, hi = self._snapshot_range(key)
+        lo = bisect.bisect_left(pifs, first, lo, hi)
+        added = self.added.iter_key(key, first)
+        head = next(added, None)
+        removed = set(self.removed.iter_key(key, first))
+        if head is None and not removed:
+            start = lo + offset
+            stop = hi if limit is None else min(hi, start + limit)
+            return (pifs[i] for i in range(start, stop))
+        merged = heapq.merge((pifs[i] for i in range(lo, hi) if pifs[i] not in removed),
+                             itertools.chain(() if head is None else (head,), added))
+        return itertools.islice(merged, offset, None if limit is None else offset + limit)
+
+    def iter_range(self, lo: str | int | None = None, hi: str | int | None = None,
+                   after: tuple | None = None) -> Iterator[tuple]:
+        """ Ленивый обход записей (ключ, pif) с lo <= ключ < hi по возрастанию
+        (None - без границы): бинарный поиск начала и последовательное чтение
+        снимка вместе с журналом. after - курсор, запись (ключ, pif), после
+        которой продолжить. """
+        self._ensure()
+        keys, pifs = self._keys, self._pifs
+        if after is not None:
+            start = (after[0], after[1] + 1)
+        else:
+            start = None if lo is None else (lo, 0)
+        if start is None:
+            first = 0
+        else:
+            k_lo, k_hi = self._snapshot_range(start[0])
+            first = bisect.bisect_left(pifs, start[1], k_lo, k_hi)
+        if hi is None or keys is None:
+            stop = len(pifs)
+        else:
+            stop = bisect.bisect_left(keys, self._encode_key(hi).ljust(keys.width, b'\0'))
+        snapshot = ((self._decode_key(keys[i]), pifs[i]) for i in range(first, stop))
+        added = self.added.iter_from(start)
+        if hi is not None:
+            added = itertools.takewhile(lambda entry: entry[0] < hi, added)
+        return heapq.merge(_without(snapshot, self.removed.iter_from(start)), added)
+
+    def add(self, key: str | int, pif: int) -> None:
+        """ Добавление записи в индекс. """
+        self.apply([], [(key, pif)])
+
+    def add_many(self, entries: list[tuple]) -> None:
+        """ Пакетное добавление записей: одна дозапись журнала или одно слияние. """
+        self.apply([], entries)
+
+    def remove(self, key: str | int, pif: int) -> None:
+        """ Удаление записи из индекса. """
+        self.apply([(key, pif)], [])
+
+    def rename(self, key: str | int, new_key: str | int, pif: int) -> None:
+        """ Замена ключа у записи (например, при смене VIN). """
+        self.apply([(key, pif)], [(new_key, pif)])
+
+    def apply(self, removed: list[tuple], added: list[tuple]) -> None:
+        """ Удаление и добавление пачки записей с одной дозаписью журнала. """
+        self._ensure()
+        if self._snapshot_id is None:
+            # Журнал всегда относится к снимку: иначе другой процесс переведёт журнал
+            # в снимок новой эпохи, и следующие записи журнала этого процесса потеряются
+            self._replace([])
+        ops = [('-', key, pif) for key, pif in removed] + [('+', key, pif) for key, pif in added]
+        # Порог растёт вместе с индексом, поэтому суммарный объём перезаписи
+        # снимка остаётся линейным от числа вставок
+        if self.delta_size + len(ops) >= max(self.merge_threshold, len(self) // 4):
+            dropped = set(removed)
+            entries = [entry for entry in self if entry not in dropped]
+            if len(entries) + len(dropped) != len(self):
+                raise ValueError(f'Записей {removed} нет в индексе {self.name}')
+            self._replace(list(heapq.merge(entries, sorted(added))))
+            return
+        for entry in removed:
+            if entry in self.added:
+                self.added.remove(entry)
+            elif entry not in self.removed and self._in_snapshot(*entry):
+                self.removed.add(entry)
+            else:
+                raise ValueError(f'Записи {entry} нет в индексе {self.name}')
+        for entry in added:
+            if entry in self.removed:
+                self.removed.remove(entry)
+            else:
+                self.added.add(entry)
+        self._log(ops)
+
+    def replace_all(self, entries: list[tuple]) -> None:
+        """ Полная замена содержимого индекса с перезаписью снимка. """
+        self._replace(sorted(entries))
+
+    def _log(self, ops: list[tuple]) -> None:
+        """ Дозапись изменений в журнал. """
+        rows = ''.join(f'{op},{key},{pif}'.ljust(INDEX_ROW_WIDTH) + '\n' for op, key, pif in ops)
+        if not os.path.exists(self.delta_path):
+            # Журнал помечается эпохой снимка, к которому относится
+            rows = f'#,{self.epoch}'.ljust(INDEX_ROW_WIDTH) + '\n' + rows
+        with open(self.delta_path, 'ab') as f:
+            f.write(rows.encode('utf-8'))
+            self._delta_offset = f.tell()
+        self._count(file_opens=1, bytes_written=rows.count('\n') * INDEX_ROW_LEN)
+        self.delta_size += len(ops)
+        self.unsynced = True
+
+    def sync(self) -> None:
+        """ Сброс снимка и журнала изменений на диск. """
+        for path in (self.snapshot_path, self.delta_path):
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    os.fsync(f.fileno())
+        self.unsynced = False
+
+    def merge(self) -> None:
+        """ Слияние журнала со снимком: перезапись отсортированного индекса. """
+        self._ensure()
+        self._replace(list(self))
+
+    def _replace(self, entries: list[tuple]) -> None:
+        """ Запись снимка по отсортированным записям и сброс журнала. """
+        self.replace_with(self.write_copy(entries))
+
+    def write_copy(self, entries: list[tuple]) -> str:
+        """ Запись снимка по отсортированным записям в новый файл рядом с текущим;
+        индекс не меняется. Возвращает путь нового файла. """
+        keys = [self._encode_key(key) for key, _ in entries]
+        width = max(map(len, keys), default=0)
+        # Эпоха отличает новый снимок от старого для журнала, пережившего замену
+        epoch = max(time.time_ns(), self.epoch + 1)
+        data = (SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.key_type is int, width, len(keys), epoch)
+                # pif в порядке байт платформы, чтобы читать их из отображения без разбора
+                + array('q', (pif for _, pif in entries)).tobytes()
+                + b''.join(key.ljust(width, b'\0') for key in keys))
+        tmp_path = write_temp(self.snapshot_path, data)
+        self._count(file_opens=1, bytes_written=len(data))
+        return tmp_path
+
+    def replace_with(self, tmp_path: str) -> None:
+        """ Подмена снимка новым, записанным write_copy, и сброс журнала.
+        Снимок подменяется через os.replace, поэтому другой процесс никогда
+        не видит наполовину записанный файл. """
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.delta_path):
+            os.remove(self.delta_path)
+        self._reset()
+        self._map()
+        self._loaded = True
+        self.unsynced = True
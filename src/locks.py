@@ -0,0 +1,123 @@
+"""Блокировки Bibip
+"""
+
+import os
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+
+class RWLock:
+    """ Блокировка «читатели-писатель»: чтения идут параллельно,
+    запись - монопольно. Ожидающий писатель не пропускает новых читателей,
+    поэтому поток чтений не может бесконечно откладывать запись.
+    Блокировка не реентерабельна.
+
+    Если задан lock_path, блокировка действует и между процессами через
+    fcntl.flock на этот файл: первый читатель процесса берёт LOCK_SH,
+    последний его снимает, писатель берёт LOCK_EX. В том же файле хранится
+    счётчик поколений, который писатели увеличивают после каждого изменения.
+    """
+    def __init__(self, lock_path: str | None = None) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._fd: int | None = None
+        if lock_path is not None:
+            self._fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # flock на чтение держится, пока в процессе есть хотя бы один читатель
+        self._shared = False
+        self._flock_mutex = threading.Lock()
+
+    def _flock(self, operation: str) -> None:
+        """ Межпроцессная блокировка файла, если она доступна. """
+        if self._fd is not None and fcntl is not None:
+            fcntl.flock(self._fd, getattr(fcntl, operation))
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """ Разделяемая блокировка на чтение. """
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            with self._flock_mutex:
+                if not self._shared:
+                    self._flock('LOCK_SH')
+                    self._shared = True
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    with self._flock_mutex:
+                        if self._shared:
+                            self._flock('LOCK_UN')
+                            self._shared = False
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """ Монопольная блокировка на запись. """
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            self._flock('LOCK_EX')
+            try:
+                yield
+            finally:
+                self._flock('LOCK_UN')
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+    def generation(self) -> int:
+        """ Текущее поколение данных (0 без файла блокировки). """
+        if self._fd is None:
+            return 0
+        data = os.pread(self._fd, 32, 0)
+        return int(data) if data.strip() else 0
+
+    def bump_generation(self) -> int:
+        """ Увеличение поколения; вызывается под блокировкой на запись. """
+        generation = self.generation() + 1
+        if self._fd is not None:
+            os.pwrite(self._fd, str(generation).ljust(32).encode(), 0)
+        return generation
+
+    def close(self) -> None:
+        """ Закрытие файла блокировки. """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def reader(method: Callable) -> Callable:
+    """ Декоратор метода CarService: выполнение под блокировкой на чтение. """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def writer(method: Callable) -> Callable:
+    """ Декоратор метода CarService: выполнение под блокировкой на запись. """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._writing():
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,130 @@
+"""Метрики Bibip
+"""
+
+import bisect
+import cProfile
+import pstats
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Счётчики ввода-вывода по файлам
+IO_COUNTERS = ('file_opens', 'seeks', 'bytes_read', 'bytes_written', 'rows_decoded')
+
+
+class Metrics:
+    """ Метрики CarService: гистограммы задержек по методам и счётчики
+    ввода-вывода по файлам (открытия, позиционирования, прочитанные и
+    записанные байты, разобранные строки). Включаются явно
+    (CarService.enable_metrics или instrumented), выключенные метрики
+    стоят одну проверку на None. Файлы копят счётчики за вызов и передают
+    их одним обращением, поэтому блокировка берётся не на каждую строку.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # метод -> [число вызовов по корзинам (последняя - выше всех границ), сумма секунд]
+        self.latency: dict[str, list] = {}
+        # имя файла -> счётчик -> значение
+        self.io: dict[str, dict[str, int]] = {}
+
+    def observe(self, method: str, seconds: float) -> None:
+        """ Учёт длительности вызова метода. """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self.latency.setdefault(method, [[0] * (len(LATENCY_BUCKETS) + 1), 0.0])
+            stats[0][bucket] += 1
+            stats[1] += seconds
+
+    def count(self, file_name: str, **counts: int) -> None:
+        """ Увеличение счётчиков ввода-вывода файла. """
+        with self._lock:
+            file_counts = self.io.setdefault(file_name, dict.fromkeys(IO_COUNTERS, 0))
+            for name, value in counts.items():
+                file_counts[name] += value
+
+    def reset(self) -> None:
+        """ Обнуление всех метрик. """
+        with self._lock:
+            self.latency.clear()
+            self.io.clear()
+
+    def as_dict(self) -> dict[str, dict]:
+        """ Снимок метрик: задержки с накопленными корзинами и счётчики по файлам. """
+        with self._lock:
+            methods = {}
+            for method, (counts, total) in self.latency.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), counts):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                methods[method] = {'count': cumulative, 'sum': total, 'buckets': buckets}
+            return {'methods': methods, 'io': {name: dict(counts) for name, counts in self.io.items()}}
+
+    def to_prometheus(self, prefix: str = 'bibip') -> str:
+        """ Метрики в текстовом формате Prometheus. """
+        snapshot = self.as_dict()
+        lines = [f'# TYPE {prefix}_method_seconds histogram']
+        for method, stats in sorted(snapshot['methods'].items()):
+            for bound, count in stats['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_method_seconds_bucket{{method="{method}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_method_seconds_sum{{method="{method}"}} {stats["sum"]}')
+            lines.append(f'{prefix}_method_seconds_count{{method="{method}"}} {stats["count"]}')
+        for counter in IO_COUNTERS:
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            for file_name, counts in sorted(snapshot['io'].items()):
+                lines.append(f'{prefix}_{counter}_total{{file="{file_name}"}} {counts[counter]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики блока scoped_metrics() в текущем потоке (контексте); другие потоки их не видят
+_scoped: ContextVar['Metrics | None'] = ContextVar('bibip_scoped_metrics', default=None)
+
+
+def active_metrics(metrics: Metrics | None) -> Metrics | None:
+    """ Метрики для учёта: блока scoped_metrics() текущего потока, иначе переданные (экземпляра). """
+    scoped = _scoped.get()
+    return metrics if scoped is None else scoped
+
+
+@contextmanager
+def scoped_metrics() -> Iterator[Metrics]:
+    """ Отдельные метрики для вызовов текущего потока внутри блока with.
+    Блоки в разных потоках не пересекаются, вложенные восстанавливают внешний. """
+    metrics = Metrics()
+    token = _scoped.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _scoped.reset(token)
+
+
+def timed(method: Callable) -> Callable:
+    """ Декоратор метода CarService: учёт длительности в self.metrics, если метрики включены. """
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = active_metrics(self.metrics)
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.observe(name, time.perf_counter() - started)
+    return wrapper
+
+
+def profile_call(func: Callable, *args: Any, **kwargs: Any) -> tuple[Any, pstats.Stats]:
+    """ Выполнение одного вызова под cProfile: результат и статистика профиля. """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profiler)
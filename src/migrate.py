@@ -0,0 +1,21 @@
+"""Перевод каталога данных Bibip в другой формат строк
+   python migrate.py <каталог> [text|packed]
+"""
+
+import argparse
+from bibip_car_service import CarService
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Перевод файлов данных в другой формат строк')
+    parser.add_argument('root_dir_path', help='каталог с файлами данных')
+    parser.add_argument('record_format', nargs='?', default='packed', choices=('text', 'packed'))
+    args = parser.parse_args(argv)
+
+    service = CarService(args.root_dir_path)
+    service.migrate(args.record_format)
+    service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -60,3 +60,4 @@ class ModelSaleStats(BaseModel):
     car_model_name: str
     brand: str
     sales_number: int
+    revenue: Decimal | None = None
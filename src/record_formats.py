@@ -0,0 +1,140 @@
+"""Форматы строк файлов данных Bibip
+"""
+
+import os
+import struct
+from datetime import datetime, timedelta
+from decimal import Decimal
+from models import CarStatus
+
+# Ширина строки данных в байтах (без перевода строки)
+DATA_ROW_WIDTH = 500
+# Длина строки данных в байтах: 500 байт + перевод строки
+# (файлы, записанные в текстовом режиме на Windows, содержат '\r\n')
+DATA_ROW_LEN = DATA_ROW_WIDTH + len(os.linesep)
+
+# Заголовок двоичного файла: сигнатура, версия формата, имя формата
+MAGIC = b'BIBIP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<5sB10s')
+
+# Даты хранятся как число микросекунд от начала эпохи
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class TextFormat:
+    """ Исходный формат: текстовые строки по 500 байт, поля через запятую.
+    Заголовка нет, поэтому старые каталоги читаются без изменений. """
+    name = 'text'
+    header = b''
+    row_len = DATA_ROW_LEN
+
+    def encode(self, row: str) -> bytes:
+        """ Строка данных фиксированной длины в байтах. """
+        data = row.encode('utf-8')
+        if len(data) > DATA_ROW_WIDTH:
+            raise ValueError(f'Строка длиннее {DATA_ROW_WIDTH} байт')
+        return data.ljust(DATA_ROW_WIDTH) + os.linesep.encode()
+
+    def decode(self, data: bytes) -> list[str]:
+        """ Байты строки в список полей. """
+        return str(data, 'utf-8').strip().split(',')
+
+
+class PackedFormat:
+    """ Двоичные строки фиксированной длины (struct). Виды полей:
+    ('str', n) - строка до n байт в utf-8, 'int' - целое,
+    'money' - сумма в копейках, 'datetime' - микросекунды от начала эпохи,
+    ('enum', значения) - номер значения в байте,
+    'flag' - необязательное последнее поле из одного символа (пометка удаления).
+    Между слоем хранения и сервисом по-прежнему ходят текстовые поля,
+    поэтому формат меняется без изменения остального кода. """
+    def __init__(self, name: str, fields: list) -> None:
+        self.name = name
+        self.fields = fields
+        self.header = HEADER.pack(MAGIC, FORMAT_VERSION, name.encode())
+        codes = {'int': 'q', 'money': 'q', 'datetime': 'q', 'flag': 'B'}
+        self._struct = struct.Struct('<' + ''.join(
+            f'{field[1]}s' if field[0] == 'str' else 'B' if field[0] == 'enum' else codes[field]
+            for field in fields))
+        self.row_len = self._struct.size
+
+    def encode(self, row: str) -> bytes:
+        """ Строка с полями через запятую в двоичную строку. """
+        values = row.split(',')
+        packed = []
+        for i, field in enumerate(self.fields):
+            value = values[i] if i < len(values) else ''
+            kind = field if isinstance(field, str) else field[0]
+            if kind == 'str':
+                data = value.encode('utf-8')
+                if len(data) > field[1]:
+                    raise ValueError(f'Поле "{value}" длиннее {field[1]} байт')
+                packed.append(data)
+            elif kind == 'int':
+                packed.append(int(value))
+            elif kind == 'money':
+                cents = Decimal(value).scaleb(2)
+                if cents != cents.to_integral_value():
+                    raise ValueError(f'Сумма "{value}" точнее копеек')
+                packed.append(int(cents))
+            elif kind == 'datetime':
+                packed.append((datetime.fromisoformat(value) - EPOCH) // MICROSECOND)
+            elif kind == 'enum':
+                packed.append(field[1].index(value))
+            else:
+                packed.append(ord(value) if value else 0)
+        return self._struct.pack(*packed)
+
+    def decode(self, data: bytes) -> list[str]:
+        """ Двоичная строка в список текстовых полей. """
+        fields = []
+        for field, value in zip(self.fields, self._struct.unpack(data)):
+            kind = field if isinstance(field, str) else field[0]
+            if kind == 'str':
+                fields.append(value.rstrip(b'\0').decode('utf-8'))
+            elif kind == 'int':
+                fields.append(str(value))
+            elif kind == 'money':
+                fields.append(str(Decimal(value).scaleb(-2)))
+            elif kind == 'datetime':
+                fields.append(str(EPOCH + value * MICROSECOND))
+            elif kind == 'enum':
+                fields.append(str(field[1][value]))
+            elif value:
+                fields.append(chr(value))
+        return fields
+
+
+TEXT_FORMAT = TextFormat()
+
+# Двоичные форматы файлов данных по имени файла
+PACKED_FORMATS = {
+    'models': PackedFormat('models', ['int', ('str', 64), ('str', 64)]),
+    'cars': PackedFormat('cars', [('str', 17), 'int', 'money', 'datetime', ('enum', tuple(CarStatus))]),
+    'sales': PackedFormat('sales', [('str', 32), ('str', 17), 'datetime', 'money', 'flag']),
+}
+
+
+def get_format(record_format: str, name: str) -> TextFormat | PackedFormat:
+    """ Формат файла данных name ('models', 'cars', 'sales') по имени формата. """
+    if record_format == 'text':
+        return TEXT_FORMAT
+    if record_format == 'packed':
+        return PACKED_FORMATS[name]
+    raise ValueError(f'Неизвестный формат "{record_format}"')
+
+
+def detect_format(path: str) -> TextFormat | PackedFormat | None:
+    """ Формат существующего файла по заголовку (None - файл пуст или его нет). """
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+    if not data.startswith(MAGIC):
+        return TEXT_FORMAT
+    _, version, name = HEADER.unpack(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Неподдерживаемая версия формата {version} в {path}')
+    return PACKED_FORMATS[name.rstrip(b'\0').decode()]
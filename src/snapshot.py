@@ -0,0 +1,148 @@
+"""Колоночный снимок данных Bibip
+"""
+
+from collections.abc import Callable
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from models import CarStatus
+from storage import FLG_DEL, RecordFile
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для снимков
+    np = None
+
+# Код статуса авто в снимке - номер значения в CarStatus
+STATUSES = tuple(CarStatus)
+STATUS_CODES = {str(status): code for code, status in enumerate(STATUSES)}
+
+
+def _cents(value: str) -> int:
+    """ Сумма в копейках из текстового поля. Обычная запись («1000.5») разбирается
+    без Decimal; запись с порядком («2E+6») и суммы точнее копеек - через Decimal,
+    доли копейки округляются до копейки (ROUND_HALF_UP). """
+    whole, _, frac = value.removeprefix('-').partition('.')
+    if whole.isdigit() and len(frac) <= 2 and (frac.isdigit() or not frac):
+        return (-1 if value.startswith('-') else 1) * (int(whole) * 100 + int(frac.ljust(2, '0')))
+    return int(Decimal(value).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _car_columns(rows: list[list[str]]) -> dict[str, 'np.ndarray']:
+    """ Строки cars в колонки. """
+    return {
+        'vin': np.array([row[0] for row in rows], dtype=str),
+        'model': np.array([int(row[1]) for row in rows], dtype=np.int64),
+        'price': np.array([_cents(row[2]) for row in rows], dtype=np.int64),  # в копейках
+        'date_start': np.array([row[3] for row in rows], dtype='datetime64[us]'),
+        'status': np.array([STATUS_CODES[row[4]] for row in rows], dtype=np.int8),
+    }
+
+
+def _sale_columns(rows: list[list[str]]) -> dict[str, 'np.ndarray']:
+    """ Строки sales в колонки. """
+    return {
+        'sales_number': np.array([row[0] for row in rows], dtype=str),
+        'vin': np.array([row[1] for row in rows], dtype=str),
+        'sales_date': np.array([row[2] for row in rows], dtype='datetime64[us]'),
+        'cost': np.array([_cents(row[3]) for row in rows], dtype=np.int64),  # в копейках
+        'active': np.array([row[4:5] != [FLG_DEL] for row in rows], dtype=bool),
+    }
+
+
+class Snapshot:
+    """ Колоночный снимок cars и sales в массивах NumPy для аналитики:
+    суммы в копейках (int64), даты - datetime64[us], статус - код (int8).
+    Снимок неизменяем: refresh возвращает новый снимок, в который дочитаны
+    новые строки и перечитаны изменённые, поэтому выданный ранее снимок
+    можно использовать дальше. Нужен numpy.
+    """
+    def __init__(self, cars: dict[str, 'np.ndarray'], sales: dict[str, 'np.ndarray']) -> None:
+        self.cars = cars
+        self.sales = sales
+
+    @classmethod
+    def build(cls, cars_file: RecordFile, sales_file: RecordFile) -> 'Snapshot':
+        """ Снимок по файлам данных целиком. """
+        if np is None:
+            raise ImportError('Для снимка данных нужен numpy')
+        return cls(_car_columns(list(cars_file.iter_rows())), _sale_columns(list(sales_file.iter_rows())))
+
+    def refresh(self, cars_file: RecordFile, sales_file: RecordFile, dirty: dict[str, set[int]]) -> 'Snapshot':
+        """ Новый снимок: дочитываются строки, дописанные в файлы, и перечитываются
+        изменённые на месте (dirty: 'cars'/'sales' -> номера строк). """
+        cars = self._merge(self.cars, cars_file, dirty['cars'], _car_columns)
+        sales = self._merge(self.sales, sales_file, dirty['sales'], _sale_columns)
+        if cars is self.cars and sales is self.sales:
+            return self
+        return Snapshot(cars, sales)
+
+    @staticmethod
+    def _merge(columns: dict[str, 'np.ndarray'], data_file: RecordFile, dirty: set[int],
+               to_columns: Callable[[list[list[str]]], dict[str, 'np.ndarray']]) -> dict[str, 'np.ndarray']:
+        """ Колонки с дочитанными новыми и перечитанными изменёнными строками. """
+        rows_count = len(next(iter(columns.values())))
+        dirty_rows = sorted(row_num for row_num in dirty if row_num < rows_count)
+        if rows_count == len(data_file) and not dirty_rows:
+            return columns
+        new_columns = to_columns(list(data_file.read_many(range(rows_count, len(data_file)))))
+        dirty_columns = to_columns(list(data_file.read_many(dirty_rows)))
+        merged = {}
+        for name, column in columns.items():
+            # concatenate возвращает новый массив и расширяет ширину строк при необходимости
+            merged_column = np.concatenate([column, new_columns[name]]).astype(
+                np.result_type(column, new_columns[name], dirty_columns[name]), copy=False)
+            merged_column[dirty_rows] = dirty_columns[name]
+            merged[name] = merged_column
+        return merged
+
+    def _sales_models(self, selected: 'np.ndarray | None' = None) -> tuple['np.ndarray', 'np.ndarray']:
+        """ id модели и номер строки для каждой неотменённой продажи (соединение по VIN);
+        selected - дополнительный отбор строк sales. Продажи без авто с их VIN пропускаются. """
+        rows = np.flatnonzero(self.sales['active'] if selected is None else self.sales['active'] & selected)
+        order = np.argsort(self.cars['vin'])
+        vins = self.cars['vin'][order]
+        if not len(vins):
+            return np.array([], dtype=np.int64), rows[:0]
+        sale_vins = self.sales['vin'][rows]
+        pos = np.minimum(np.searchsorted(vins, sale_vins), len(vins) - 1)
+        found = vins[pos] == sale_vins
+        return self.cars['model'][order][pos[found]], rows[found]
+
+    def sales_by_model(self) -> dict[int, int]:
+        """ Число продаж по id модели. """
+        model_ids, counts = np.unique(self._sales_models()[0], return_counts=True)
+        return {int(model_id): int(count) for model_id, count in zip(model_ids, counts)}
+
+    def model_sales(self, since: datetime | None = None,
+                    until: datetime | None = None) -> list[tuple[int, int, Decimal]]:
+        """ (id модели, число продаж, сумма) по продажам с since <= sales_date < until
+        (None - без границы). Модели идут в порядке первой продажи в sales. """
+        dates = self.sales['sales_date']
+        selected = np.ones(len(dates), dtype=bool)
+        if since is not None:
+            selected &= dates >= np.datetime64(since, 'us')
+        if until is not None:
+            selected &= dates < np.datetime64(until, 'us')
+        models, rows = self._sales_models(selected)
+        model_ids, first, model_idx = np.unique(models, return_index=True, return_inverse=True)
+        counts = np.bincount(model_idx, minlength=len(model_ids))
+        sums = np.zeros(len(model_ids), dtype=np.int64)
+        np.add.at(sums, model_idx, self.sales['cost'][rows])
+        return [(int(model_ids[i]), int(counts[i]), Decimal(int(sums[i])).scaleb(-2)) for i in np.argsort(first)]
+
+    def revenue_by_month(self) -> dict[str, Decimal]:
+        """ Сумма продаж по месяцам ('ГГГГ-ММ'). """
+        active = self.sales['active']
+        months, month_idx = np.unique(self.sales['sales_date'][active].astype('datetime64[M]'), return_inverse=True)
+        sums = np.zeros(len(months), dtype=np.int64)
+        np.add.at(sums, month_idx, self.sales['cost'][active])
+        return {str(month): Decimal(int(cents)).scaleb(-2) for month, cents in zip(months, sums)}
+
+    def average_price_by_status(self) -> dict[CarStatus, Decimal]:
+        """ Средняя цена авто по статусу. """
+        status = self.cars['status']
+        counts = np.bincount(status, minlength=len(STATUSES))
+        sums = np.zeros(len(STATUSES), dtype=np.int64)
+        np.add.at(sums, status, self.cars['price'])
+        return {STATUSES[code]: (Decimal(int(sums[code])) / int(counts[code])).scaleb(-2).quantize(Decimal('0.01'))
+                for code in range(len(STATUSES)) if counts[code]}
@@ -0,0 +1,256 @@
+"""Хранилище Bibip
+   pos_in_file = pif
+"""
+
+import os
+import mmap
+import tempfile
+from collections.abc import Iterable, Iterator
+from itertools import chain
+from metrics import active_metrics
+from record_formats import TEXT_FORMAT, PackedFormat, TextFormat, detect_format
+
+# Признак удаления (flg_del) - пятое поле строки продажи, дописывается при отмене
+FLG_DEL = '1'
+
+
+def write_temp(path: str, data: bytes) -> str:
+    """ Запись данных в новый файл с уникальным именем рядом с path (для подмены
+    через os.replace). Имя уникально и внутри процесса: подготовка сжатия и
+    слияние индекса, идущие одновременно, не перезаписывают файлы друг друга. """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    # mkstemp создаёт файл с правами 0o600, а подменяемые файлы открыты для чтения всем
+    os.fchmod(fd, 0o644)
+    with open(fd, 'wb') as f:
+        f.write(data)
+    return tmp_path
+
+
+class RecordFile:
+    """ Файл данных из строк фиксированной длины (cars, models, sales).
+    k-я строка лежит по смещению len(header) + k * row_len; длину строки,
+    заголовок и разбор строки задаёт формат (record_formats). Формат
+    существующего файла определяется по заголовку, record_format задаёт
+    формат нового файла. В режиме use_mmap файл
+    отображается в память один раз: чтение идёт срезами memoryview без
+    системных вызовов, запись на месте - присваиванием в отображение,
+    при росте файла отображение пересоздаётся. Без use_mmap файл
+    открывается на каждую операцию, как раньше.
+    """
+    def __init__(self, path: str, use_mmap: bool = False,
+                 record_format: TextFormat | PackedFormat = TEXT_FORMAT) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        self.use_mmap = use_mmap
+        # Metrics для счётчиков ввода-вывода (None - не считать)
+        self.metrics = None
+        self.format = detect_format(path) or record_format
+        if self.format.header and (not os.path.exists(path) or not os.path.getsize(path)):
+            # Новый файл начинается с заголовка формата
+            with open(path, 'wb') as f:
+                f.write(self.format.header)
+        self._fd: int | None = None
+        self._mm: mmap.mmap | None = None
+        if use_mmap:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._remap()
+
+    def _offset(self, row_num: int) -> int:
+        """ Смещение строки в файле. """
+        return len(self.format.header) + row_num * self.format.row_len
+
+    def _remap(self) -> None:
+        """ Пересоздание отображения под текущий размер файла.
+        Старое отображение не закрывается явно: его ещё может читать другой
+        поток, и оно освободится, когда на него не останется ссылок. """
+        size = os.fstat(self._fd).st_size
+        # Пустой файл отобразить нельзя
+        self._mm = mmap.mmap(self._fd, size) if size else None
+
+    def _mapped(self, end: int) -> mmap.mmap:
+        """ Отображение, покрывающее байты до end (файл мог вырасти). """
+        if self._mm is None or len(self._mm) < end:
+            self._remap()
+            if self._mm is None or len(self._mm) < end:
+                raise IndexError(f'Строка за пределами файла {self.path}')
+        return self._mm
+
+    def _count(self, **counts: int) -> None:
+        """ Учёт ввода-вывода, если метрики включены. """
+        metrics = active_metrics(self.metrics)
+        if metrics is not None:
+            metrics.count(self.name, **counts)
+
+    def _encode(self, row: str | bytes) -> bytes:
+        """ Строка данных фиксированной длины в байтах; уже закодированная строка не меняется. """
+        return row if isinstance(row, bytes) else self.format.encode(row)
+
+    def __len__(self) -> int:
+        if self._fd is not None:
+            size = os.fstat(self._fd).st_size
+        elif os.path.exists(self.path):
+            size = os.path.getsize(self.path)
+        else:
+            return 0
+        return max(size - len(self.format.header), 0) // self.format.row_len
+
+    def view(self, row_num: int) -> memoryview:
+        """ Строка без копирования (только в режиме use_mmap). """
+        offset = self._offset(row_num)
+        return memoryview(self._mapped(offset + self.format.row_len))[offset:offset + self.format.row_len]
+
+    def read_fields(self, row_num: int) -> list[str]:
+        """ Чтение строки и разбиение на поля. """
+        return next(self.read_many([row_num]))
+
+    def read_many(self, row_nums: Iterable[int]) -> Iterator[list[str]]:
+        """ Ленивое чтение строк по номерам с одним открытием файла. """
+        row_nums = iter(row_nums)
+        first = next(row_nums, None)
+        # Читать нечего или файла ещё нет (пустой каталог) - файл не открывается
+        if first is None or not self.use_mmap and not os.path.exists(self.path):
+            return
+        row_nums = chain([first], row_nums)
+        decode, row_len = self.format.decode, self.format.row_len
+        rows = 0
+        try:
+            if self.use_mmap:
+                for row_num in row_nums:
+                    rows += 1
+                    with self.view(row_num) as row:
+                        yield decode(row)
+                return
+            with open(self.path, 'rb') as f:
+                for row_num in row_nums:
+                    rows += 1
+                    f.seek(self._offset(row_num))
+                    yield decode(f.read(row_len))
+        finally:
+            self._count(file_opens=int(not self.use_mmap), seeks=0 if self.use_mmap else rows,
+                        bytes_read=rows * row_len, rows_decoded=rows)
+
+    def read_raw(self, row_nums: Iterable[int]) -> list[bytes]:
+        """ Чтение строк без разбора, в байтах (для отката операции). """
+        row_len = self.format.row_len
+        row_nums = list(row_nums)
+        if not row_nums or not self.use_mmap and not os.path.exists(self.path):
+            return []
+        if self.use_mmap:
+            rows = [bytes(self.view(row_num)) for row_num in row_nums]
+        else:
+            rows = []
+            with open(self.path, 'rb') as f:
+                for row_num in row_nums:
+                    f.seek(self._offset(row_num))
+                    rows.append(f.read(row_len))
+        self._count(file_opens=int(not self.use_mmap), seeks=0 if self.use_mmap else len(rows),
+                    bytes_read=len(rows) * row_len)
+        return rows
+
+    def iter_rows(self) -> Iterator[list[str]]:
+        """ Последовательное чтение всех строк. """
+        if self.use_mmap:
+            yield from self.read_many(range(len(self)))
+            return
+        if not os.path.exists(self.path):
+            return
+        decode, row_len = self.format.decode, self.format.row_len
+        rows = 0
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(len(self.format.header))
+                while row := f.read(row_len):
+                    rows += 1
+                    yield decode(row)
+        finally:
+            self._count(file_opens=1, seeks=1, bytes_read=rows * row_len, rows_decoded=rows)
+
+    def write(self, row_num: int, row: str | bytes) -> None:
+        """ Перезапись строки на месте. """
+        self.write_many([(row_num, row)])
+
+    def write_many(self, rows: Iterable[tuple[int, str | bytes]]) -> None:
+        """ Перезапись нескольких строк на месте с одним открытием файла. """
+        row_len = self.format.row_len
+        written = 0
+        if self.use_mmap:
+            for row_num, row in rows:
+                offset = self._offset(row_num)
+                self._mapped(offset + row_len)[offset:offset + row_len] = self._encode(row)
+                written += 1
+            self._count(bytes_written=written * row_len)
+            return
+        # Файла может не быть при восстановлении по журналу предзаписи
+        with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as f:
+            for row_num, row in rows:
+                f.seek(self._offset(row_num))
+                f.write(self._encode(row))
+                written += 1
+        self._count(file_opens=1, seeks=written, bytes_written=written * row_len)
+
+    def append(self, rows: Iterable[str | bytes]) -> int:
+        """ Дозапись строк в конец файла одним блоком. Возвращает номер первой строки. """
+        data = b''.join(self._encode(row) for row in rows)
+        first_row = len(self)
+        self._count(file_opens=int(self._fd is None), bytes_written=len(data))
+        if self._fd is not None:
+            os.pwrite(self._fd, data, self._offset(first_row))
+            self._remap()
+            return first_row
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        return first_row
+
+    def truncate(self, row_count: int) -> None:
+        """ Отбрасывание строк после первых row_count (откат дозаписи). """
+        size = self._offset(row_count)
+        if self._fd is not None:
+            os.ftruncate(self._fd, size)
+            self._remap()
+        elif os.path.exists(self.path):
+            os.truncate(self.path, size)
+
+    def rewrite(self, rows: Iterable[str], record_format: TextFormat | PackedFormat | None = None) -> None:
+        """ Полная перезапись файла: новый файл подменяет старый через os.replace.
+        record_format - перевод файла в другой формат. """
+        self.replace_with(self.write_copy(rows, record_format), record_format)
+
+    def write_copy(self, rows: Iterable[str], record_format: TextFormat | PackedFormat | None = None) -> str:
+        """ Запись строк в новый файл рядом с текущим; текущий файл не меняется,
+        поэтому строки можно читать из него же. Возвращает путь нового файла. """
+        record_format = record_format or self.format
+        data = record_format.header + b''.join(record_format.encode(row) for row in rows)
+        tmp_path = write_temp(self.path, data)
+        self._count(file_opens=1, bytes_written=len(data))
+        return tmp_path
+
+    def replace_with(self, tmp_path: str, record_format: TextFormat | PackedFormat | None = None) -> None:
+        """ Подмена файла новым, записанным write_copy. """
+        os.replace(tmp_path, self.path)
+        if record_format is not None:
+            self.format = record_format
+        if self._fd is not None:
+            # Открытый дескриптор указывает на старый файл - открываем заново
+            self.close()
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._remap()
+
+    def sync(self) -> None:
+        """ Сброс файла на диск. """
+        if self._mm is not None:
+            self._mm.flush()
+        if self._fd is not None:
+            os.fsync(self._fd)
+        elif os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                os.fsync(f.fileno())
+
+    def close(self) -> None:
+        """ Закрытие отображения и файла. """
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,81 @@
+"""Журнал предзаписи Bibip
+"""
+
+import os
+import json
+from itertools import count
+from metrics import active_metrics
+
+
+class WriteAheadLog:
+    """ Журнал предзаписи (wal.log) для операций, меняющих несколько файлов.
+    Перед изменением файлов данных операция пишет одну запись со всеми
+    строками, которые она запишет: [файл, номер строки, текст строки],
+    и сбрасывает журнал на диск (fsync). После выполнения дописывается
+    отметка о завершении, без отдельного fsync. Запись строки по номеру
+    идемпотентна, поэтому при восстановлении записи можно повторять.
+    Файлы данных и индексов сбрасываются на диск не на каждой операции,
+    а пачкой при контрольной точке, после которой журнал очищается.
+    """
+    def __init__(self, path: str, sync: bool = True) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        self.sync = sync
+        # Metrics для счётчиков ввода-вывода (None - не считать)
+        self.metrics = None
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        # Номера операций уникальны между процессами, пишущими в один журнал
+        self._tx_ids = count(1)
+        # Завершённые операции с последней контрольной точки
+        self.committed = 0
+
+    def _write(self, record: dict) -> None:
+        data = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        os.write(self._fd, data)
+        metrics = active_metrics(self.metrics)
+        if metrics is not None:
+            metrics.count(self.name, bytes_written=len(data))
+
+    def begin(self, op: str, writes: list[tuple[str, int, str]]) -> str:
+        """ Запись операции в журнал до изменения файлов. """
+        tx = f'{os.getpid()}-{next(self._tx_ids)}'
+        self._write({'tx': tx, 'op': op, 'writes': writes})
+        if self.sync:
+            os.fsync(self._fd)
+        return tx
+
+    def commit(self, tx: str) -> None:
+        """ Отметка о завершении операции. """
+        self._write({'tx': tx, 'commit': True})
+        self.committed += 1
+
+    def records(self) -> list[dict]:
+        """ Операции в журнале (с отметкой 'committed'). Оборванная запись в конце
+        пропускается: операция не начинала менять файлы до её сброса на диск. """
+        operations: dict[str, dict] = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for row in f:
+                try:
+                    record = json.loads(row)
+                except json.JSONDecodeError:
+                    break
+                if record.get('commit'):
+                    if record['tx'] in operations:
+                        operations[record['tx']]['committed'] = True
+                else:
+                    record['committed'] = False
+                    operations[record['tx']] = record
+        return list(operations.values())
+
+    def truncate(self) -> None:
+        """ Очистка журнала после контрольной точки. """
+        os.ftruncate(self._fd, 0)
+        if self.sync:
+            os.fsync(self._fd)
+        self.committed = 0
+
+    def close(self) -> None:
+        """ Закрытие файла журнала. """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,12 +1,35 @@
-from datetime import datetime
-from decimal import Decimal
+import asyncio
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_HALF_UP, Decimal
 
+import numpy as np
 import pytest
 
+from async_car_service import AsyncCarService
+from benchmarks.bench_car_service import bench_size, compare
 from bibip_car_service import CarService
+from indexes import INDEX_ROW_WIDTH, FileIndex, PackedEntries
+from metrics import profile_call
 from models import Car, CarFullInfo, CarStatus, Model, ModelSaleStats, Sale
 
 
+def _sell_in_process(root_dir_path: str, vins: list[str]) -> None:
+    service = CarService(root_dir_path)
+    for vin in vins:
+        service.sell_car(Sale(sales_number=f"#{vin}", car_vin=vin,
+                              sales_date=datetime(2024, 9, 1), cost=Decimal("1500")))
+
+
+def _crash_during_sell(root_dir_path: str, sale: Sale) -> None:
+    service = CarService(root_dir_path)
+    # Процесс падает после записи продажи, но до изменения статуса авто в cars
+    service.cars_file.write_many = lambda rows: os._exit(1)
+    service.sell_car(sale)
+
+
 @pytest.fixture
 def car_data():
     return [
@@ -298,3 +321,1008 @@ class TestCarServiceScenarios:
             ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
         ]
         assert service.top_models_by_sales() == top_3_models
+
+    # 8
+    def test_lookup_in_large_index(self, tmpdir: str):
+        service = CarService(tmpdir)
+
+        # id моделей больше 9, чтобы числовой и строковый порядок различались
+        for model_id in range(25, 0, -1):
+            service.add_model(Model(id=model_id, name=f"Model{model_id}", brand="Brand"))
+        for i in range(100):
+            service.add_car(
+                Car(
+                    vin=f"VIN{(i * 37) % 100:014d}",
+                    model=i % 25 + 1,
+                    price=Decimal("1000"),
+                    date_start=datetime(2024, 1, 1),
+                    status=CarStatus.available,
+                )
+            )
+
+        for i in range(100):
+            info = service.get_car_info(f"VIN{(i * 37) % 100:014d}")
+            assert info is not None
+            assert info.car_model_name == f"Model{i % 25 + 1}"
+        assert service.get_car_info("VIN99999999999999") is None
+
+        for model_id in range(1, 26):
+            assert service._read_model(model_id).name == f"Model{model_id}"
+
+    # 9
+    def test_index_survives_restart(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+        service.update_vin("KNAGM4A77D5316538", "UPDGM4A77D5316538")
+
+        # Новый экземпляр читает основной файл индекса и журнал изменений
+        restarted = CarService(tmpdir)
+        assert restarted.get_car_info("KNAGM4A77D5316538") is None
+        info = restarted.get_car_info("UPDGM4A77D5316538")
+        assert info is not None
+        assert info.car_model_name == "Optima"
+
+        restarted.car_index.merge()
+        assert CarService(tmpdir).get_car_info("UPDGM4A77D5316538") == info
+
+    # 10
+    def test_bulk_load_and_sell(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        service.add_models(iter(model_data))
+        service.add_cars(car for car in car_data)
+
+        sales = [
+            Sale(
+                sales_number=f"20240903#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2000"),
+            )
+            for vin in ["VF1LZL2T4BC242298", "KNAGM4A77D5316538", "5N1CR2TS0HW037674"]
+        ]
+        sold = service.sell_cars(sales)
+
+        assert [car.vin for car in sold] == [sale.car_vin for sale in sales]
+        assert all(car.status == CarStatus.sold for car in sold)
+        for sale in sales:
+            info = service.get_car_info(sale.car_vin)
+            assert info is not None
+            assert info.status == CarStatus.sold
+            assert info.sales_cost == sale.cost
+
+        with pytest.raises(ValueError):
+            service.sell_cars([sales[0].model_copy(update={"car_vin": "UNKNOWNVIN0000000"})])
+
+    # 11
+    def test_list_cars_by_status_after_sale_and_revert(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sale = Sale(
+            sales_number="20240903#JM1BL1M58C1614725",
+            car_vin="JM1BL1M58C1614725",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2399.99"),
+        )
+        service.sell_car(sale)
+
+        reserved = [car for car in car_data if car.status == CarStatus.reserve and car.vin != sale.car_vin]
+        assert service.get_cars(CarStatus.reserve) == reserved
+        assert [car.vin for car in service.get_cars(CarStatus.sold)] == [sale.car_vin]
+
+        service.revert_sale(sale.sales_number)
+
+        assert service.get_cars(CarStatus.sold) == []
+        assert [car.vin for car in CarService(tmpdir).get_cars(CarStatus.available)] == [
+            car.vin for car in car_data if car.status == CarStatus.available or car.vin == sale.car_vin
+        ]
+
+    # 12
+    def test_paginate_cars_by_status(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        available_cars = [car for car in car_data if car.status == CarStatus.available]
+
+        pages = []
+        cars, cursor = service.get_cars_page(CarStatus.available, limit=3)
+        pages.append(cars)
+        while cursor is not None:
+            cars, cursor = service.get_cars_page(CarStatus.available, cursor=cursor, limit=3)
+            pages.append(cars)
+
+        assert [len(page) for page in pages] == [3, 3, 2]
+        assert [car for page in pages for car in page] == available_cars
+        assert list(service.iter_cars(CarStatus.available, offset=2, limit=4)) == available_cars[2:6]
+        assert service.get_cars_page(CarStatus.sold) == ([], None)
+
+    # 13
+    def test_mmap_storage(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, use_mmap=True)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2999.99"),
+        )
+        service.sell_car(sale)
+        service.update_vin("5XYPH4A10GG021831", "UPDPH4A10GG021831")
+
+        info = service.get_car_info("KNAGM4A77D5316538")
+        assert info is not None
+        assert info.sales_cost == sale.cost
+        assert service.get_car_info("UPDPH4A10GG021831") is not None
+
+        # Файл вырос после отображения - отображение пересоздаётся
+        service.add_car(car_data[0].model_copy(update={"vin": "NEWGM4A77D5316538"}))
+        assert service.get_car_info("NEWGM4A77D5316538") is not None
+
+        service.revert_sale(sale.sales_number)
+        service.close()
+
+        # Текстовый режим читает те же файлы
+        plain = CarService(tmpdir)
+        assert plain.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+        assert len(plain.get_cars(CarStatus.available)) == 9
+
+    # 14
+    def test_top_models_after_revert_and_restart(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        service.sell_cars(
+            Sale(
+                sales_number=f"20240903#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, 3),
+                cost=Decimal("2000"),
+            )
+            for vin in ["JM1BL1TFXD1734246", "JM1BL1M58C1614725", "KNAGM4A77D5316538", "5N1CR2MN9EC641864"]
+        )
+        service.revert_sale("20240903#JM1BL1M58C1614725")
+
+        top_models = [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=1),
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1),
+            ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1),
+        ]
+        assert service.top_models_by_sales() == top_models
+        assert CarService(tmpdir).top_models_by_sales() == top_models
+
+        # Каталог без файла счётчиков пересчитывается при запуске
+        os.remove(os.path.join(tmpdir, "model_sales.txt"))
+        assert CarService(tmpdir).top_models_by_sales() == top_models
+
+    # 15
+    def test_top_models_by_revenue_in_window(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sold = [
+            ("KNAGM4A77D5316538", datetime(2024, 9, 3), "1999.09"),
+            ("KNAGH4A48A5414970", datetime(2024, 9, 4), "2100"),
+            ("KNAGR4A63D5359556", datetime(2024, 9, 5), "7623"),
+            ("JM1BL1M58C1614725", datetime(2024, 9, 6), "2334"),
+            ("JM1BL1L83C1660152", datetime(2024, 9, 7), "451"),
+            ("5N1CR2TS0HW037674", datetime(2024, 9, 8), "9876"),
+            ("5XYPH4A10GG021831", datetime(2024, 9, 9), "1234"),
+        ]
+        service.sell_cars(
+            Sale(sales_number=f"#{vin}", car_vin=vin, sales_date=sales_date, cost=Decimal(cost))
+            for vin, sales_date, cost in sold
+        )
+
+        assert service.top_models_by_sales(n=2, by="revenue") == [
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=3, revenue=Decimal("11722.09")),
+            ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1, revenue=Decimal("9876")),
+        ]
+        assert service.top_models_by_sales(since=datetime(2024, 9, 5), until=datetime(2024, 9, 8)) == [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=2, revenue=Decimal("2785")),
+            ModelSaleStats(car_model_name="Optima", brand="Kia", sales_number=1, revenue=Decimal("7623")),
+        ]
+        with pytest.raises(ValueError):
+            service.top_models_by_sales(by="margin")
+
+        # Окно считается по снимку, в который дочитываются изменения после прошлого отчёта
+        service.revert_sale("#KNAGR4A63D5359556")
+        assert service.top_models_by_sales(since=datetime(2024, 9, 5), until=datetime(2024, 9, 8)) == [
+            ModelSaleStats(car_model_name="3", brand="Mazda", sales_number=2, revenue=Decimal("2785")),
+        ]
+        assert service.top_models_by_sales(n=1, by="revenue") == [
+            ModelSaleStats(car_model_name="Pathfinder", brand="Nissan", sales_number=1, revenue=Decimal("9876")),
+        ]
+
+    # 16
+    def test_revert_sale_tombstone_and_compact(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        first_sale = Sale(
+            sales_number="20240903#KNAGM4A77D5316538",
+            car_vin="KNAGM4A77D5316538",
+            sales_date=datetime(2024, 9, 3),
+            cost=Decimal("2999.99"),
+        )
+        other_sale = first_sale.model_copy(update={"sales_number": "20240904#JM1BL1M58C1614725",
+                                                   "car_vin": "JM1BL1M58C1614725"})
+        second_sale = first_sale.model_copy(update={"sales_number": "20240905#KNAGM4A77D5316538",
+                                                    "cost": Decimal("2500")})
+        service.sell_car(first_sale)
+        service.sell_car(other_sale)
+        service.revert_sale(first_sale.sales_number)
+
+        # Отменённая продажа остаётся в файле с признаком удаления
+        assert service.sales_file.read_fields(0)[4] == "1"
+        with pytest.raises(ValueError):
+            service.revert_sale(first_sale.sales_number)
+
+        # Новая продажа занимает строку отменённой вместо дозаписи в конец
+        service.sell_car(second_sale)
+        assert len(service.sales_file) == 2
+        assert service.sales_file.read_fields(0)[0] == second_sale.sales_number
+
+        service.revert_sale(other_sale.sales_number)
+        assert service.compact() == 1
+        assert service.compact() == 0
+        assert len(service.sales_file) == 1
+
+        for restarted in (service, CarService(tmpdir)):
+            info = restarted.get_car_info("KNAGM4A77D5316538")
+            assert info is not None
+            assert info.sales_cost == Decimal("2500")
+            assert restarted.get_car_info("JM1BL1M58C1614725").status == CarStatus.available
+
+    # 17
+    def test_get_sale_by_number(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        sales = [
+            Sale(
+                sales_number=f"202409{day:02d}#{vin}",
+                car_vin=vin,
+                sales_date=datetime(2024, 9, day),
+                cost=Decimal("2000") + day,
+            )
+            for day, vin in enumerate(["VF1LZL2T4BC242298", "KNAGM4A77D5316538", "5N1CR2TS0HW037674"], start=1)
+        ]
+        service.sell_cars(sales)
+        service.revert_sale(sales[0].sales_number)
+
+        assert service.get_sale(sales[0].sales_number) is None
+        assert service.get_sale(sales[1].sales_number) == sales[1]
+
+        service.compact()
+        assert CarService(tmpdir).get_sale(sales[2].sales_number) == sales[2]
+
+    # 18
+    def test_cache_invalidation(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, cache_size=16)
+
+        self._fill_initial_data(service, car_data, model_data)
+
+        vin = "KNAGM4A77D5316538"
+        info = service.get_car_info(vin)
+        info.price = Decimal("1")  # изменение копии не портит кэш
+        assert service.get_car_info(vin).price == Decimal("2000")
+        assert service.cache_stats()["car_info"]["hits"] == 1
+
+        sale = Sale(sales_number=f"20240903#{vin}", car_vin=vin,
+                    sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99"))
+        service.sell_car(sale)
+        assert service.get_car_info(vin).sales_cost == sale.cost
+
+        service.revert_sale(sale.sales_number)
+        assert service.get_car_info(vin).status == CarStatus.available
+
+        service.update_vin(vin, "UPDGM4A77D5316538")
+        assert service.get_car_info(vin) is None
+        assert service.get_car_info("UPDGM4A77D5316538").vin == "UPDGM4A77D5316538"
+
+        uncached = CarService(tmpdir, cache_size=0)
+        uncached.get_car_info("UPDGM4A77D5316538")
+        uncached.get_car_info("UPDGM4A77D5316538")
+        assert uncached.cache_stats()["car_info"] == {"hits": 0, "misses": 2, "size": 0, "maxsize": 0}
+
+    # 19
+    def test_concurrent_sales_no_lost_updates(self, tmpdir: str):
+        service = CarService(tmpdir)
+
+        service.add_models(Model(id=model_id, name=f"Model{model_id}", brand="Brand") for model_id in range(1, 5))
+        vins = [f"VIN{i:014d}" for i in range(200)]
+        service.add_cars(
+            Car(vin=vin, model=i % 4 + 1, price=Decimal("1000"), date_start=datetime(2024, 1, 1),
+                status=CarStatus.available)
+            for i, vin in enumerate(vins)
+        )
+
+        errors = []
+        stop = threading.Event()
+        readers_ready = threading.Barrier(5)
+        # Чтения, увидевшие промежуточное состояние: часть авто уже продана
+        overlapped = []
+        partial_seen = threading.Event()
+
+        def sell(worker: int) -> None:
+            try:
+                worker_vins = vins[worker::8]
+                for i, vin in enumerate(worker_vins):
+                    if i == len(worker_vins) // 2:
+                        # Блокировка пропускает писателей вперёд, поэтому на полпути
+                        # писатели ждут, пока читатели увидят частично проданные авто
+                        partial_seen.wait(timeout=10)
+                    service.sell_car(Sale(sales_number=f"#{vin}", car_vin=vin,
+                                          sales_date=datetime(2024, 9, 1), cost=Decimal("1500")))
+            except Exception as exc:  # pragma: no cover - ошибка попадёт в assert ниже
+                errors.append(exc)
+
+        def read(reader_num: int) -> None:
+            try:
+                sold_before, available_before = 0, 200
+                readers_ready.wait()
+                while not stop.is_set():
+                    # Каждое чтение - одно взятие блокировки (200 авто меньше ITER_CHUNK),
+                    # поэтому проданных только прибавляется, доступных - только убавляется
+                    sold = len(service.get_cars(CarStatus.sold))
+                    available = len(service.get_cars(CarStatus.available))
+                    assert sold >= sold_before and available <= available_before
+                    if 0 < sold < 200:
+                        overlapped.append(sold)
+                        partial_seen.set()
+                    sold_before, available_before = sold, available
+                    # Статус авто и его продажа согласованы в одном чтении
+                    info = service.get_car_info(vins[reader_num * 8])
+                    assert (info.status == CarStatus.sold) == (info.sales_date is not None)
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+
+        readers = [threading.Thread(target=read, args=(reader_num,)) for reader_num in range(4)]
+        writers = [threading.Thread(target=sell, args=(worker,)) for worker in range(8)]
+        for thread in readers:
+            thread.start()
+        readers_ready.wait()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+        assert overlapped, "чтения не пересеклись с продажами"
+        assert errors == []
+        for checked in (service, CarService(tmpdir)):
+            assert len(checked.get_cars(CarStatus.sold)) == 200
+            assert len(checked.sales_file) == 200
+            assert all(checked.get_sale(f"#{vin}") is not None for vin in vins)
+            assert sum(stats.sales_number for stats in checked.top_models_by_sales(n=4)) == 200
+
+    # 20
+    def test_instances_see_each_other_changes(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        first = CarService(tmpdir)
+        second = CarService(tmpdir)
+
+        self._fill_initial_data(first, car_data, model_data)
+        assert second.get_car_info("KNAGM4A77D5316538") is not None
+
+        second.sell_car(Sale(sales_number="#1", car_vin="KNAGM4A77D5316538",
+                             sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99")))
+        assert first.get_car_info("KNAGM4A77D5316538").status == CarStatus.sold
+
+        first.revert_sale("#1")
+        first.compact()
+        assert second.get_sale("#1") is None
+        assert second.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+        assert len(second.get_cars(CarStatus.available)) == 8
+
+    # 21
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="нужен fork")
+    def test_concurrent_processes_no_lost_updates(self, tmpdir: str):
+        service = CarService(tmpdir)
+
+        service.add_models(Model(id=model_id, name=f"Model{model_id}", brand="Brand") for model_id in range(1, 5))
+        vins = [f"VIN{i:014d}" for i in range(120)]
+        service.add_cars(
+            Car(vin=vin, model=i % 4 + 1, price=Decimal("1000"), date_start=datetime(2024, 1, 1),
+                status=CarStatus.available)
+            for i, vin in enumerate(vins)
+        )
+
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=_sell_in_process, args=(tmpdir, vins[worker::4])) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        assert [process.exitcode for process in processes] == [0] * 4
+        assert len(service.get_cars(CarStatus.sold)) == 120
+        assert len(service.sales_file) == 120
+        assert sum(stats.sales_number for stats in service.top_models_by_sales(n=4)) == 120
+
+    # 22
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="нужен fork")
+    def test_recovery_after_crash_during_sale(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+
+        sale = Sale(sales_number="20240903#KNAGM4A77D5316538", car_vin="KNAGM4A77D5316538",
+                    sales_date=datetime(2024, 9, 3), cost=Decimal("1999.09"))
+        process = multiprocessing.get_context("fork").Process(target=_crash_during_sell, args=(tmpdir, sale))
+        process.start()
+        process.join()
+        assert process.exitcode == 1
+        assert os.path.getsize(os.path.join(tmpdir, "wal.log")) > 0
+
+        # Продажа записана, а статус авто - нет; при открытии операция доводится до конца
+        restarted = CarService(tmpdir)
+        assert os.path.getsize(os.path.join(tmpdir, "wal.log")) == 0
+        for checked in (restarted, service):
+            assert checked.get_car_info("KNAGM4A77D5316538").status == CarStatus.sold
+            assert checked.get_sale(sale.sales_number) == sale
+            assert "KNAGM4A77D5316538" not in [car.vin for car in checked.get_cars(CarStatus.available)]
+            assert checked.top_models_by_sales(n=1)[0].sales_number == 1
+
+        restarted.revert_sale(sale.sales_number)
+        assert service.get_car_info("KNAGM4A77D5316538").status == CarStatus.available
+
+    # 23
+    def test_async_service_batches_writes_and_coalesces_reads(self, tmpdir: str, car_data: list[Car],
+                                                               model_data: list[Model]):
+        service = CarService(tmpdir)
+        service.add_models(model_data)
+        calls = {"add_cars": 0, "sell_cars": 0, "get_car_info": 0}
+        for name in calls:
+            method = getattr(service, name)
+
+            def counted(*args, _name=name, _method=method):
+                calls[_name] += 1
+                return _method(*args)
+            setattr(service, name, counted)
+
+        async def scenario():
+            async_service = AsyncCarService(service)
+            await asyncio.gather(*(async_service.add_car(car) for car in car_data))
+            sold = await asyncio.gather(
+                async_service.sell_car(Sale(sales_number="#1", car_vin="KNAGM4A77D5316538",
+                                            sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99"))),
+                async_service.sell_car(Sale(sales_number="#2", car_vin="UNKNOWN0000000000",
+                                            sales_date=datetime(2024, 9, 3), cost=Decimal("100"))),
+                async_service.sell_car(Sale(sales_number="#3", car_vin="5XYPH4A10GG021831",
+                                            sales_date=datetime(2024, 9, 4), cost=Decimal("2500"))),
+                return_exceptions=True,
+            )
+            infos = await asyncio.gather(*(async_service.get_car_info("KNAGM4A77D5316538") for _ in range(10)))
+            available = await async_service.get_cars(CarStatus.available)
+            top = await async_service.top_models_by_sales(n=1)
+            await async_service.close()
+            return sold, infos, available, top
+
+        sold, infos, available, top = asyncio.run(scenario())
+
+        assert calls["add_cars"] == 1
+        assert len(service.cars_file) == len(car_data)
+        # Неизвестный VIN не мешает остальным продажам пачки: пачка повторяется по одной продаже
+        assert calls["sell_cars"] == 4
+        assert isinstance(sold[1], ValueError)
+        assert [sold[0].status, sold[2].status] == [CarStatus.sold, CarStatus.sold]
+        assert calls["get_car_info"] == 1
+        assert all(info.status == CarStatus.sold for info in infos)
+        assert len({id(info) for info in infos}) == 10
+        assert "KNAGM4A77D5316538" not in [car.vin for car in available]
+        assert top[0].sales_number == 1
+
+    # 24
+    def test_get_car_info_many(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="#1", car_vin="JM1BL1M58C1614725",
+                              sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99")))
+
+        vins = [car.vin for car in reversed(car_data)] + ["UNKNOWN0000000000", car_data[0].vin]
+        expected = [service.get_car_info(vin) for vin in vins]
+        service.car_info_cache.clear()
+
+        infos = service.get_car_info_many(vins)
+        assert infos == expected
+        assert infos[-2] is None
+        assert service.get_car_info("JM1BL1M58C1614725").sales_cost == Decimal("2999.99")
+        # Повторный запрос обслуживается из кэша
+        assert service.get_car_info_many(vins) == expected
+
+    # 25
+    @pytest.mark.parametrize("use_mmap", [False, True])
+    def test_packed_record_format(self, tmpdir: str, car_data: list[Car], model_data: list[Model], use_mmap: bool):
+        text_dir = os.path.join(tmpdir, "text")
+        packed_dir = os.path.join(tmpdir, "packed")
+        os.mkdir(text_dir)
+        os.mkdir(packed_dir)
+        sales = [Sale(sales_number=f"#{i}", car_vin=car.vin, sales_date=datetime(2024, 9, i + 1, 12, 30),
+                      cost=Decimal("1999.09")) for i, car in enumerate(car_data[:4])]
+        services = [CarService(text_dir, use_mmap=use_mmap),
+                    CarService(packed_dir, use_mmap=use_mmap, record_format="packed")]
+        for service in services:
+            self._fill_initial_data(service, car_data, model_data)
+            service.sell_cars(sales)
+            service.revert_sale("#1")
+            service.compact()
+            service.update_vin(car_data[5].vin, "UPDGM4A77D5316538")
+        text, packed = services
+
+        vins = [car.vin for car in car_data[:5]] + ["UPDGM4A77D5316538"]
+        assert packed.get_car_info_many(vins) == text.get_car_info_many(vins)
+        assert packed.get_cars(CarStatus.available) == text.get_cars(CarStatus.available)
+        assert packed.top_models_by_sales() == text.top_models_by_sales()
+        assert os.path.getsize(os.path.join(packed_dir, "cars.txt")) * 10 < os.path.getsize(
+            os.path.join(text_dir, "cars.txt"))
+
+        # Формат существующего каталога определяется по заголовку файлов
+        assert CarService(packed_dir).get_car_info_many(vins) == text.get_car_info_many(vins)
+
+        # Перевод текстового каталога в двоичный формат и обратно
+        text.migrate("packed")
+        assert os.path.getsize(os.path.join(text_dir, "cars.txt")) == os.path.getsize(
+            os.path.join(packed_dir, "cars.txt"))
+        restarted = CarService(text_dir)
+        assert restarted.get_car_info_many(vins) == packed.get_car_info_many(vins)
+        assert restarted.get_sale("#2") == sales[2]
+        restarted.migrate("text")
+        assert CarService(text_dir).get_cars(CarStatus.sold) == packed.get_cars(CarStatus.sold)
+
+    # 26
+    def test_columnar_snapshot(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_cars([
+            Sale(sales_number="#1", car_vin=car_data[0].vin, sales_date=datetime(2024, 8, 3), cost=Decimal("1000.50")),
+            Sale(sales_number="#2", car_vin=car_data[1].vin, sales_date=datetime(2024, 9, 3), cost=Decimal("2000")),
+        ])
+        first = service.snapshot()
+        assert sum(first.sales_by_model().values()) == 2
+        assert first.revenue_by_month() == {"2024-08": Decimal("1000.50"), "2024-09": Decimal("2000")}
+
+        # Снимок обновляется по новым и изменённым строкам, старый снимок не меняется
+        service.revert_sale("#1")
+        service.sell_car(Sale(sales_number="#3", car_vin=car_data[2].vin, sales_date=datetime(2024, 9, 5),
+                              cost=Decimal("99.99")))
+        service.update_vin(car_data[3].vin, "UPDGM4A77D5316538")
+        service.add_car(Car(vin="NEWCAR00000000001", model=1, price=Decimal("3000"),
+                            date_start=datetime(2024, 10, 1), status=CarStatus.available))
+        second = service.snapshot()
+        assert len(first.cars["vin"]) == len(car_data)
+        assert first.revenue_by_month()["2024-08"] == Decimal("1000.50")
+        assert service.snapshot() is second
+
+        fresh = CarService(tmpdir).snapshot()
+        for name in second.cars:
+            assert np.array_equal(second.cars[name], fresh.cars[name])
+        for name in second.sales:
+            assert np.array_equal(second.sales[name], fresh.sales[name])
+        assert "UPDGM4A77D5316538" in second.cars["vin"]
+        assert second.revenue_by_month() == {"2024-09": Decimal("2099.99")}
+        assert sum(second.sales_by_model().values()) == 2
+
+        cars = service.get_cars(CarStatus.available)
+        average = (sum(car.price for car in cars) / len(cars)).quantize(Decimal("0.01"))
+        assert second.average_price_by_status()[CarStatus.available] == average
+
+        # Запись с порядком разбирается, доли копейки округляются до копейки
+        service.add_cars([Car(vin="EXPCAR00000000001", model=1, price=Decimal("2E+6"),
+                              date_start=datetime(2024, 10, 2), status=CarStatus.reserve),
+                          Car(vin="SUBCENT0000000001", model=1, price=Decimal("10.995"),
+                              date_start=datetime(2024, 10, 3), status=CarStatus.reserve)])
+        prices = [car.price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                  for car in service.get_cars(CarStatus.reserve)]
+        assert Decimal("11.00") in prices
+        average = (sum(prices) / len(prices)).quantize(Decimal("0.01"))
+        assert service.snapshot().average_price_by_status()[CarStatus.reserve] == average
+
+    # 27
+    def test_trusted_and_validated_reads_match(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="#1", car_vin=car_data[0].vin,
+                              sales_date=datetime(2024, 9, 3, 10, 15, 30, 120000), cost=Decimal("2999.99")))
+
+        validated = CarService(tmpdir, validate_reads=True)
+        vins = [car.vin for car in car_data]
+        assert service.get_car_info_many(vins) == validated.get_car_info_many(vins)
+        assert service.get_cars(CarStatus.available) == validated.get_cars(CarStatus.available)
+        assert service.get_sale("#1") == validated.get_sale("#1")
+        assert service.get_sale("#1").sales_date == datetime(2024, 9, 3, 10, 15, 30, 120000)
+        assert service.get_car_info(car_data[0].vin).status is CarStatus.sold
+
+    # 28
+    def test_benchmark_harness_smoke(self, tmpdir: str):
+        results = bench_size(300, tmpdir, memory=True, wal_sync=False)
+
+        ops = [result["op"] for result in results]
+        assert ops[:5] == ["add_models", "add_cars", "add_car", "sell_cars", "sell_car"]
+        assert {"get_car_info_many", "top_models_by_sales", "revert_sale", "compact", "open"} <= set(ops)
+        assert all(result["seconds"] >= 0 and result["peak_bytes"] > 0 for result in results)
+
+        slower = [dict(result, seconds=result["seconds"] * 2 + 1) for result in results]
+        assert compare(slower, {"results": results}, threshold=1.2) == slower
+        assert compare(results, {"results": results}, threshold=1.2) == []
+
+    # 29
+    def test_metrics_and_profiling(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir, cache_size=0)
+        self._fill_initial_data(service, car_data, model_data)
+        assert service.metrics is None
+
+        with service.instrumented() as metrics:
+            service.sell_car(Sale(sales_number="#1", car_vin=car_data[0].vin,
+                                  sales_date=datetime(2024, 9, 3), cost=Decimal("2999.99")))
+            for car in car_data:
+                service.get_car_info(car.vin)
+            service.top_models_by_sales()
+        service.get_car_info(car_data[0].vin)
+        assert service.metrics is None
+
+        stats = metrics.as_dict()
+        assert stats["methods"]["get_car_info"]["count"] == len(car_data)
+        assert stats["methods"]["sell_car"]["count"] == stats["methods"]["sell_cars"]["count"] == 1
+        assert stats["io"]["cars.txt"]["rows_decoded"] >= len(car_data)
+        assert stats["io"]["cars.txt"]["bytes_written"] > 0
+        assert stats["io"]["sales.txt"]["rows_decoded"] == 1
+        assert stats["io"]["wal.log"]["bytes_written"] > 0
+        # Продажа читает строку авто, сохраняет её прежний вид для отката и пишет
+        # новую, get_car_info читает её один раз, ТОП-3 по счётчикам cars не читает
+        assert stats["io"]["cars.txt"]["file_opens"] == 3 + len(car_data)
+
+        text = metrics.to_prometheus()
+        assert f'bibip_method_seconds_count{{method="get_car_info"}} {len(car_data)}' in text
+        assert 'bibip_method_seconds_bucket{method="get_car_info",le="+Inf"}' in text
+        assert 'bibip_rows_decoded_total{file="cars.txt"}' in text
+
+        enabled = service.enable_metrics()
+        info, profile = profile_call(service.get_car_info, car_data[0].vin)
+        assert info.status == CarStatus.sold
+        assert profile.total_calls > 0
+        assert enabled.as_dict()["methods"]["get_car_info"]["count"] == 1
+        service.disable_metrics()
+
+        # Блок считает только вызовы своего потока; блоки в разных потоках,
+        # закрытые не в порядке открытия, не оставляют метрики включёнными
+        a_entered, b_entered, a_exited = threading.Event(), threading.Event(), threading.Event()
+        scoped = {}
+
+        def block_a():
+            with service.instrumented() as metrics_a:
+                a_entered.set()
+                b_entered.wait(timeout=5)
+                service.get_car_info(car_data[0].vin)
+            scoped["a"] = metrics_a
+            a_exited.set()
+
+        def block_b():
+            a_entered.wait(timeout=5)
+            with service.instrumented() as metrics_b:
+                b_entered.set()
+                a_exited.wait(timeout=5)
+                service.get_car_info(car_data[1].vin)
+                service.get_car_info(car_data[2].vin)
+            scoped["b"] = metrics_b
+
+        threads = [threading.Thread(target=block_a), threading.Thread(target=block_b)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert scoped["a"].as_dict()["methods"]["get_car_info"]["count"] == 1
+        assert scoped["b"].as_dict()["methods"]["get_car_info"]["count"] == 2
+        service.get_car_info(car_data[3].vin)
+        assert scoped["a"].as_dict()["methods"]["get_car_info"]["count"] == 1
+        assert service.metrics is None
+
+    # 30
+    def test_index_snapshot_lazy_load(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.update_vin(car_data[0].vin, "UPDGM4A77D5316538")
+        service.car_index.merge()
+        service.close()
+        assert os.path.exists(os.path.join(tmpdir, "cars_index.bin"))
+        assert not os.path.exists(os.path.join(tmpdir, "cars_index.txt"))
+
+        # Индексы не нужны при открытии и загружаются при первом обращении
+        restarted = CarService(tmpdir)
+        for index in (restarted.model_index, restarted.car_index, restarted.sale_index,
+                      restarted.sales_number_index, restarted.car_status_index, restarted.car_date_index,
+                      restarted.free_index):
+            assert not index._loaded
+        info = restarted.get_car_info("UPDGM4A77D5316538")
+        assert restarted.model_index._loaded
+        assert info is not None and info.car_model_name == "Optima"
+        assert restarted.get_car_info(car_data[0].vin) is None
+        assert restarted.get_cars(CarStatus.available) == service.get_cars(CarStatus.available)
+
+        # Каталог без списка построенных индексов: вторичные индексы строятся один раз
+        os.remove(os.path.join(tmpdir, "indexes.txt"))
+        os.remove(os.path.join(tmpdir, "cars_status_index.bin"))
+        rebuilt = CarService(tmpdir)
+        assert rebuilt.get_cars(CarStatus.available) == service.get_cars(CarStatus.available)
+        assert os.path.exists(os.path.join(tmpdir, "indexes.txt"))
+        assert not CarService(tmpdir).car_status_index._loaded
+
+        # Журнал, переживший перезапись снимка, относится к старой эпохе и не применяется
+        index = FileIndex(os.path.join(tmpdir, "extra_index.txt"), key_type=int)
+        index.add_many([(3, 30), (1, 10)])
+        with open(index.delta_path, "r", encoding="utf-8") as f:
+            stale_delta = f.read()
+        index.remove(1, 10)
+        index.merge()
+        with open(index.delta_path, "w", encoding="utf-8") as f:
+            f.write(stale_delta)
+        assert list(FileIndex(index.path, key_type=int)) == [(3, 30)]
+
+        # Текстовый индекс прежних версий переводится в снимок
+        legacy_path = os.path.join(tmpdir, "legacy_index.txt")
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{key},{pif}".ljust(INDEX_ROW_WIDTH) + "\n" for key, pif in [("A", 2), ("B", 1)]))
+        with open(os.path.splitext(legacy_path)[0] + ".delta", "w", encoding="utf-8") as f:
+            f.write("+,C,5".ljust(INDEX_ROW_WIDTH) + "\n" + "-,A,2".ljust(INDEX_ROW_WIDTH) + "\n")
+        legacy = FileIndex(legacy_path)
+        assert list(legacy) == [("B", 1), ("C", 5)]
+        assert legacy.find("C") == 5 and legacy.find("A") is None
+        assert not os.path.exists(legacy_path)
+        assert os.path.exists(legacy.snapshot_path)
+
+    # 31
+    def test_packed_index_entries(self, tmpdir: str):
+        index = FileIndex(os.path.join(tmpdir, "cars_index.txt"))
+        entries = PackedEntries(index._encode_key, index._decode_key)
+        # Ключи разной длины расширяют буфер, больше CHUNK_SIZE записей делят блоки
+        expected = sorted((f"VIN{i * 7919 % 3000:0{i % 5 + 1}d}", i) for i in range(3000))
+        for entry in reversed(expected):
+            entries.add(entry)
+        assert len(entries) == len(expected)
+        assert list(entries) == expected
+        assert entries.width == max(len(key) for key, _ in expected)
+        assert len(entries._pifs) > 1
+
+        key, pif = expected[1234]
+        assert (key, pif) in entries and (key, pif + 1) not in entries
+        entries.rename(key, "UPDGM4A77D5316538", pif)
+        assert list(entries.iter_key("UPDGM4A77D5316538")) == [pif]
+        assert list(entries.iter_key(key)) == [p for k, p in expected if k == key and p != pif]
+        for entry in expected[:2000]:
+            if entry != (key, pif):
+                entries.remove(entry)
+        assert list(entries) == sorted(expected[2000:] + [("UPDGM4A77D5316538", pif)])
+        with pytest.raises(ValueError):
+            entries.remove(expected[0])
+
+    # 32
+    def test_free_rows_and_online_compact(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        sales = [Sale(sales_number=f"#{i}", car_vin=car.vin, sales_date=datetime(2024, 9, i + 1),
+                      cost=Decimal("1500")) for i, car in enumerate(car_data[:4])]
+        service.sell_cars(sales)
+        for sale in sales[:3]:
+            service.revert_sale(sale.sales_number)
+        assert service.free_index.find_all("sales") == [0, 1, 2]
+
+        # Список свободных строк сохраняется, а для старых каталогов собирается по sales
+        os.remove(CarService(tmpdir).free_index.snapshot_path)
+        restarted = CarService(tmpdir)
+        assert restarted.free_index.find_all("sales") == [0, 1, 2]
+        restarted.sell_cars(sales[:2])
+        assert restarted.free_index.find_all("sales") == [2]
+        assert len(restarted.sales_file) == 4
+        assert restarted.get_sale("#1") == sales[1]
+
+        # Пока готовятся новые файлы, чтения из других потоков не ждут сжатия
+        prepare = restarted._prepare_compact
+        infos = []
+
+        def prepare_with_reader():
+            reader_thread = threading.Thread(target=lambda: infos.append(restarted.get_car_info(sales[3].car_vin)))
+            reader_thread.start()
+            reader_thread.join(timeout=5)
+            return prepare()
+        restarted._prepare_compact = prepare_with_reader
+        assert restarted.compact_in_background().result(timeout=10) == 1
+        assert infos and infos[0].status == CarStatus.sold
+
+        assert len(restarted.sales_file) == 3
+        assert restarted.free_index.find_all("sales") == []
+        for service in (restarted, CarService(tmpdir)):
+            assert [service.get_sale(sale.sales_number) for sale in sales] == [sales[0], sales[1], None, sales[3]]
+            assert service.get_car_info(sales[2].car_vin).status == CarStatus.available
+
+        # Слияние индекса во время подготовки сжатия не трогает подготовленные файлы
+        restarted.revert_sale(sales[0].sales_number)
+        prepared = restarted._prepare_compact()
+        restarted.sale_index.merge()
+        assert all(os.path.exists(path) for path in prepared[1:])
+        restarted._discard_compact(prepared)
+        restarted._discard_compact(prepared)
+        assert restarted.compact() == 1
+        assert not [name for name in os.listdir(tmpdir) if name.endswith(".tmp")]
+
+    # 33
+    def test_vin_prefix_and_date_range(self, tmpdir: str, car_data: list[Car], model_data: list[Model],
+                                       monkeypatch: pytest.MonkeyPatch):
+        # Маленькие порции, чтобы обход продолжался по курсору между ними
+        monkeypatch.setattr("bibip_car_service.ITER_CHUNK", 2)
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.car_index.merge()
+        service.update_vin("JM1BL1TFXD1734246", "JM1BL0TFXD1734246")
+
+        jm1bl = sorted(vin for vin in (car.vin for car in car_data) if vin.startswith("JM1BL"))
+        jm1bl[jm1bl.index("JM1BL1TFXD1734246")] = "JM1BL0TFXD1734246"
+        found = service.find_cars_by_vin_prefix("JM1BL")
+        assert next(found).vin == sorted(jm1bl)[0]
+        assert [car.vin for car in found] == sorted(jm1bl)[1:]
+        assert [car.vin for car in service.find_cars_by_vin_prefix("5N1")] == \
+            sorted(car.vin for car in car_data if car.vin.startswith("5N1"))
+        assert list(service.find_cars_by_vin_prefix("ZZZ")) == []
+        assert len(list(service.find_cars_by_vin_prefix(""))) == len(car_data)
+
+        for restarted in (service, CarService(tmpdir)):
+            in_may = list(restarted.find_cars_by_date_start(datetime(2024, 5, 1), datetime(2024, 6, 1)))
+            assert [car.date_start for car in in_may] == [datetime(2024, 5, 17)] * 3
+            assert {car.vin for car in in_may} == {"JM1BL0TFXD1734246", "JM1BL1M58C1614725", "KNAGR4A63D5359556"}
+            dates = [car.date_start for car in restarted.find_cars_by_date_start(date_to=datetime(2024, 6, 2))]
+            assert dates == sorted(car.date_start for car in car_data if car.date_start < datetime(2024, 6, 2))
+            assert len(list(restarted.find_cars_by_date_start(datetime(2024, 8, 1)))) == 1
+
+        # Даты с часовым поясом переводятся в UTC: 2031-01-01 02:00+03:00 - это 2030-12-31 23:00 UTC
+        aware = car_data[0].model_copy(update={"vin": "TZAGM4A77D5316538",
+                                               "date_start": datetime(2031, 1, 1, 2, tzinfo=timezone(timedelta(hours=3)))})
+        service.add_car(aware)
+        in_2030 = service.find_cars_by_date_start(datetime(2030, 12, 31, tzinfo=timezone.utc),
+                                                  datetime(2031, 1, 1))
+        assert [car.vin for car in in_2030] == ["TZAGM4A77D5316538"]
+        assert [car.vin for car in CarService(tmpdir).find_cars_by_date_start(datetime(2030, 12, 31, 23))] == \
+            ["TZAGM4A77D5316538"]
+
+    # 34
+    def test_reports_follow_renamed_cars(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="#1", car_vin=car_data[0].vin, sales_date=datetime(2024, 9, 1),
+                              cost=Decimal("1000")))
+        service.sell_car(Sale(sales_number="#2", car_vin=car_data[1].vin, sales_date=datetime(2024, 9, 2),
+                              cost=Decimal("2000")))
+        top = service.top_models_by_sales()
+        # Продажа #1 переходит на новый VIN вместе с авто
+        service.update_vin(car_data[0].vin, "UPDGM4A77D5316538")
+        assert service.get_sale("#1").car_vin == "UPDGM4A77D5316538"
+        assert service.get_car_info("UPDGM4A77D5316538").sales_date == datetime(2024, 9, 1)
+
+        # Счётчики и агрегация по снимку дают одинаковый ответ
+        def counts(stats: list[ModelSaleStats]) -> list[tuple[str, int]]:
+            return [(model.car_model_name, model.sales_number) for model in stats]
+
+        assert service.top_models_by_sales() == top
+        assert counts(service.top_models_by_sales(since=datetime(2000, 1, 1))) == counts(top)
+        by_revenue = service.top_models_by_sales(by="revenue")
+        assert sorted(counts(by_revenue)) == sorted(counts(top))
+        assert sum(model.revenue for model in by_revenue) == Decimal("3000")
+        assert CarService(tmpdir).top_models_by_sales() == top
+
+    # 35
+    def test_failed_writes_are_not_replayed(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+
+        # Строку, которую нельзя записать, сервис отклоняет до записи в журнал
+        with pytest.raises(ValueError, match="длиннее"):
+            service.add_model(Model(id=100, name="X" * 600, brand="Lada"))
+        # Ошибка после начала записи: операция откатывается и не повторяется при открытии
+        sale = Sale(sales_number="#1", car_vin=car_data[0].vin, sales_date=datetime(2024, 9, 3),
+                    cost=Decimal("1000"))
+
+        def fail(entries):
+            raise OSError("диск переполнен")
+
+        service.sale_index.add_many = fail
+        with pytest.raises(OSError):
+            service.sell_car(sale)
+        assert len(service.sales_file) == 0
+        assert service.get_car_info(car_data[0].vin).status == CarStatus.available
+
+        restarted = CarService(tmpdir)
+        assert restarted._read_model(100) is None
+        assert restarted.get_sale("#1") is None
+        assert restarted.get_car_info(car_data[0].vin).status == CarStatus.available
+        assert restarted.sell_car(sale).status == CarStatus.sold
+
+        packed_dir = os.path.join(tmpdir, "packed")
+        os.mkdir(packed_dir)
+        packed = CarService(packed_dir, record_format="packed")
+        with pytest.raises(ValueError, match="точнее копеек"):
+            packed.add_car(car_data[0].model_copy(update={"price": Decimal("1.005")}))
+        assert CarService(packed_dir, record_format="packed").get_cars(CarStatus.available) == []
+
+    # 36
+    def test_reopen_without_close(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        service.sell_car(Sale(sales_number="#1", car_vin=car_data[0].vin, sales_date=datetime(2024, 9, 1),
+                              cost=Decimal("1000")))
+        service.update_vin(car_data[0].vin, "UPDGM4A77D5316538")
+
+        # Завершённые операции живого процесса не приводят к перестроению индексов
+        generation = service._lock.generation()
+        reopened = CarService(tmpdir)
+        assert reopened._lock.generation() == generation
+        assert [car.vin for car in reopened.get_cars(CarStatus.sold)] == ["UPDGM4A77D5316538"]
+
+        # Оборванная операция перестраивает индексы; счётчики после перестроения те же
+        top = service.top_models_by_sales()
+        assert top
+        service._wal.begin("sell_cars", [])
+        recovered = CarService(tmpdir)
+        assert recovered._lock.generation() != generation
+        assert [car.vin for car in recovered.get_cars(CarStatus.sold)] == ["UPDGM4A77D5316538"]
+        assert recovered.top_models_by_sales() == top
+
+        # Изменения индексов и счётчиков сбрасываются на диск раньше отметки о завершении,
+        # поэтому после отключения питания завершённой операции не нужно перестроение
+        unsynced_at_commit = []
+        commit = recovered._wal.commit
+
+        def checked_commit(tx):
+            unsynced_at_commit.append(any(index.unsynced
+                                          for index in (*recovered._indexes(), recovered.model_sales)))
+            commit(tx)
+
+        recovered._wal.commit = checked_commit
+        recovered.sell_car(Sale(sales_number="#2", car_vin=car_data[1].vin, sales_date=datetime(2024, 9, 2),
+                                cost=Decimal("2000")))
+        recovered.revert_sale("#2")
+        assert unsynced_at_commit == [False, False]
+
+    # 37
+    def test_generation_changes_only_on_writes(self, tmpdir: str, car_data: list[Car], model_data: list[Model]):
+        service = CarService(tmpdir)
+        self._fill_initial_data(service, car_data, model_data)
+        other = CarService(tmpdir)
+        assert other.get_cars(CarStatus.available) == service.get_cars(CarStatus.available)
+        status_index = other.car_status_index
+
+        # Отклонённая операция, пустое сжатие и close() данных не меняют
+        generation = service._lock.generation()
+        with pytest.raises(ValueError):
+            service.revert_sale("#404")
+        assert service.compact() == 0
+        CarService(tmpdir).close()
+        assert service._lock.generation() == generation
+
+        # Чужую продажу другой процесс подхватывает, дочитав журналы индексов
+        service.sell_car(Sale(sales_number="#1", car_vin=car_data[0].vin, sales_date=datetime(2024, 9, 1),
+                              cost=Decimal("1000")))
+        assert service._lock.generation() != generation
+        assert [car.vin for car in other.get_cars(CarStatus.sold)] == [car_data[0].vin]
+        assert other.car_status_index is status_index and status_index._loaded
+        assert other.get_sale("#1").car_vin == car_data[0].vin
+
+    # 38
+    def test_queries_on_empty_directory(self, tmpdir: str, model_data: list[Model]):
+        for use_mmap in (False, True):
+            root = os.path.join(tmpdir, f"mmap-{use_mmap}")
+            os.mkdir(root)
+            service = CarService(root, use_mmap=use_mmap)
+            for step in ("пустой каталог", "только модели"):
+                assert service.get_cars(CarStatus.available) == [], step
+                assert service.get_cars_page(CarStatus.available) == ([], None), step
+                assert service.get_car_info_many(["KNAGM4A77D5316538"]) == [None], step
+                assert service.top_models_by_sales() == [], step
+                service.add_models(model_data)